@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+"""
+Benchmark stages of the pipeline on synthetic citation profiles.
+
+Profiles of given sizes are generated by wosserver.py, with heavy-tailed
+numbers of citing papers. Each stage is timed separately:
+    scrape.search, scrape.report, scrape.papers - WebOfScience against a local
+        wosserver (needs Chrome and Selenium, so only for small profiles)
+    load, load.citing - loading saved results as search() does, and reading
+        their citing papers on first use
+    bibtex.papers, bibtex.citing - BibTex.runBatch of papers and citing papers
+    latex - WebOfScience.latex, including pdflatex
+    write.json, write.html, write.md - report writers, without LaTeX
+
+Timings are saved as JSON, and can be compared with an earlier run:
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from time import time, strftime
+
+import records
+from wosserver import Profile, Server
+
+
+def entry(record):
+    """ Bibtex entry of a profile record, as stored by WebOfScience. """
+    return {
+        'ID': record['uid'][4:],
+        'ENTRYTYPE': 'article',
+        'author': ' and '.join(record['authors']),
+        'title': '{' + record['title'] + '}',
+        'journal': record['iso'],
+        'year': record['year'],
+        'volume': record['volume'],
+        'pages': record['pages'],
+        'doi': record['doi'],
+    }
+
+
+def results(profile):
+    """ Results of WebOfScience for the profile, without scraping. """
+    noself = set([r['uid'][4:] for r in profile.noself()])
+    number, citations, citationsnoself, h = profile.totals()
+    papers = []
+    index = {}
+    for paper in profile.sorted('PY.D'):
+        e = entry(paper)
+        impact = profile.journals[paper['issn']]
+        e.update({'impact' + t.replace(' ', ''): i for t, i in impact})
+        citing = [entry(r) for r in profile.cited(paper)]
+        e['cited'] = str(len(citing))
+        e['citing'] = tuple([c['ID'] for c in citing])
+        e['citednoself'] = str(len([c for c in citing if c['ID'] in noself]))
+        papers.append(e)
+        for c in citing:
+            index[c['ID']] = records.Record(c)
+    return {
+        'query': 'AU=doe,j*',
+        'number': str(number),
+        'citations': str(citations),
+        'citationsnoself': str(citationsnoself),
+        'h-index': str(h),
+        'citing': noself,
+        'papers': papers,
+        'citingindex': index,
+        'errors': [],
+    }
+
+
+class Timer(object):
+
+    """ Collect best times of named stages over repeated runs. """
+
+    def __init__(self):
+        """ Start with no timings. """
+        self.times = {}
+        self.errors = {}
+
+    def __call__(self, stage, function, *args, **kwargs):
+        """ Time function call as stage, return its result or None. """
+        start = time()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            self.failed(stage, e)
+            return None
+        seconds = time() - start
+        self.times[stage] = min(seconds, self.times.get(stage, seconds))
+        return result
+
+    def failed(self, stage, error):
+        """ Record error of a stage, dropping its timing. """
+        self.times.pop(stage, None)
+        self.errors[stage] = '{}: {}'.format(type(error).__name__, error)
+
+
+def scrape(timer, profile, latency, workers, fast=False):
+    """ Time scraping of the profile served by a local wosserver. """
+    try:
+        from wos import WebOfScience
+    except ImportError as e:
+        return timer.failed('scrape', e)
+    server = Server(profile, latency=latency)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    wos = WebOfScience(base_url=server.url, fast=fast)
+    try:
+        # Chrome starts on first use of the driver
+        if timer('scrape.start', getattr, wos, 'driver') is None:
+            return
+        timer('scrape.search', wos.search, 'AU=doe,j*')
+        timer('scrape.report', wos.report)
+        timer('scrape.papers', wos.papers, workers)
+        # papers that could not be fetched only end up in errors
+        fetched = len(wos.results['papers'])
+        if fetched != len(profile.papers) or wos.results['errors']:
+            timer.failed('scrape.papers', AssertionError(
+                'fetched {} of {} papers, {} errors'.format(
+                    fetched, len(profile.papers), len(wos.results['errors']))))
+    finally:
+        wos.close()
+        server.shutdown()
+
+
+def load(timer, data, path):
+    """ Time loading of saved results, as in search(). """
+    name = os.path.join(path, 'results.dat')
+    records.save(data, name)
+    results = timer('load', records.load, name)
+    if results is not None:
+        timer('load.citing', results.read)
+
+
+def bibtex(timer, data, engine):
+    """ Time formatting of papers and citing papers, as in latex(). """
+    from bibtex import BibTex
+    bib = BibTex(engine, authorStyle='textbf', titleStyle='textit')
+    bib2 = BibTex(engine, genBibitems=True, IncludeDOIURL='Exclude')
+    papers = [{k: v for k, v in p.items() if k != 'citing'}
+              for p in data['papers']]
+    citing = data['citingindex'].values()
+    for stage, bib, entries in (('bibtex.papers', bib, papers),
+                                ('bibtex.citing', bib2, citing)):
+        items = timer(stage, bib.runBatch, entries)
+        # runBatch returns no items if bibtex is missing or fails
+        if items is not None and len(items) != len(entries):
+            timer.failed(stage, AssertionError(
+                'formatted {} of {} entries'.format(len(items),
+                                                    len(entries))))
+
+
+def latex(timer, data, engine, path):
+    """ Time generation of the PDF file. """
+    try:
+        from wos import WebOfScience
+    except ImportError as e:
+        return timer.failed('latex', e)
+    # latex only needs results, so the browser is never started
+    wos = WebOfScience()
+    wos.results = data
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        timer('latex', wos.latex, 'results', engine=engine)
+        # name.hash is only written after pdflatex built name.pdf
+        if 'latex' in timer.times and not os.path.exists('results.hash'):
+            timer.failed('latex', AssertionError('results.pdf not built'))
+    finally:
+        os.chdir(cwd)
+        wos.close()
+
+
+def write(timer, data, path):
+    """ Time writing reports without LaTeX. """
+    from writers import WRITERS
+    index = data['citingindex']
+
+    def citing(paper):
+        return [index[i] for i in paper['citing'] if i in index]
+    for ext, writer in sorted(WRITERS.items()):
+        timer('write.' + ext, writer(data, citing).write,
+              os.path.join(path, 'results'))
+
+
+def run(sizes, repeat=1, scrape_max=100, latency=0, workers=1,
+        engine='bibtex', seed=0, fast=False):
+    """ Benchmark all stages for profiles of given sizes. """
+    report = {
+        'date': strftime('%Y-%m-%d %H:%M:%S'),
+        'python': sys.version.split()[0],
+        'commit': commit(),
+        'engine': engine,
+        'latency': latency,
+        'workers': workers,
+        'fast': fast,
+        'profiles': {},
+    }
+    for size in sizes:
+        profile = Profile(size, seed)
+        data = results(profile)
+        timer = Timer()
+        for _ in range(repeat):
+            path = tempfile.mkdtemp()
+            try:
+                if size <= scrape_max:
+                    scrape(timer, profile, latency, workers, fast)
+                load(timer, data, path)
+                bibtex(timer, data, engine)
+                latex(timer, data, engine, path)
+                write(timer, data, path)
+            finally:
+                shutil.rmtree(path, ignore_errors=True)
+        report['profiles'][str(size)] = {
+            'papers': size,
+            'citations': int(data['citations']),
+            'citing': len(data['citingindex']),
+            'times': timer.times,
+            'errors': timer.errors,
+        }
+        print size, ' '.join(['{}={:.3f}'.format(k, v)
+                              for k, v in sorted(timer.times.items())])
+        for k, v in sorted(timer.errors.items()):
+            print '   ', k, 'failed:', v
+    return report
+
+
+def commit():
+    """ Current git commit, if available. """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.realpath(__file__))).strip()
+    except:
+        return None
+
+
+def compare(old, new, threshold=0.1):
+    """ Print stages slower in new than in old by more than threshold. """
+    regressions = 0
+    for size in sorted(new['profiles'], key=int):
+        if size not in old['profiles']:
+            continue
+        before = old['profiles'][size]['times']
+        after = new['profiles'][size]['times']
+        for stage in sorted(after):
+            if stage not in before or not before[stage]:
+                continue
+            ratio = after[stage] / before[stage]
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = ' REGRESSION'
+                regressions += 1
+            print '{:>6} {:<15} {:9.3f} -> {:9.3f} {:6.2f}x{}'.format(
+                size, stage, before[stage], after[stage], ratio, flag)
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 100, 1000, 10000],
+                        help='numbers of papers in profiles')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='keep the best time of this many runs')
+    parser.add_argument('--scrape-max', type=int, default=100,
+                        help='largest profile scraped with a browser')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds of latency of the local server')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of browsers fetching papers')
+    parser.add_argument('--engine', default='bibtex',
+                        choices=['bibtex', 'python'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fast', action='store_true',
+                        help='scrape with headless Chrome in fast mode')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='earlier results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as regression')
+    args = parser.parse_args()
+    report = run(args.sizes, args.repeat, args.scrape_max, args.latency,
+                 args.workers, args.engine, args.seed, args.fast)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if compare(old, report, args.threshold):
+            sys.exit(1)
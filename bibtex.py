@@ -1,9 +1,16 @@
 """ Class for handling BibTex interactions. """
 
-from collections import defaultdict
-from tempfile import NamedTemporaryFile as tempFile
+from collections import defaultdict, OrderedDict
+from tempfile import mkdtemp, NamedTemporaryFile as tempFile
+from threading import Lock
+import hashlib
 import os
+import pickle
+import pipes
 import re
+import shutil
+
+from bst import Style
 
 
 # HTML formatting for LaTex commands
@@ -14,44 +21,141 @@ _HTML = {
     'textsc': r'<font style="font-variant:small-caps;">',
 }
 
+# postprocessing patterns
+_LEADING = re.compile(r"^[\n\r\s]*")
+_NEWLINE = re.compile(r"(?<=[^\n])\n")
+_SPACES = re.compile(r" +")
+_BIBKEY = re.compile(r"BIBKEY_START(.*?)BIBKEY_END")
+_HTML_PLACE = re.compile(r"start_html_(%s)_start|end_html_(?:%s)_end"
+                         % ('|'.join(_HTML), '|'.join(_HTML)))
+# HTML places and numbers put in items by the bst file
+_TOKEN = re.compile(r"start_html_(%s)_start|end_html_(?:%s)_end|"
+                    r"(MR|ZBL|AR|DOI|URL)_START(.*?)\2_END"
+                    % ('|'.join(_HTML), '|'.join(_HTML)), re.S)
+_COMMANDS = {'MR': r"\mref{MR", 'AR': r"\arxiv{", 'ZBL': r"\zbl{",
+             'DOI': r"\doi{", 'URL': r"\url{"}
+_END = re.compile(r"[A-Z]{2,3}_END")
+_START = re.compile(r"(MR|AR|ZBL|DOI|URL)_START")
+_HTML_START = re.compile(r"(?s)start_html_(\w+)_start")
+_HTML_END = re.compile(r"(?s)end_html_(\w+)_end")
+_CPRIME = re.compile(r"(?s)\\cprime")
+_BOLD = re.compile(r"(?s)\\(bold|Bbb)")
+_BRACED = re.compile(r"\{([A-Z])\}")
+_SPACE = re.compile(r"\s")
+
+# generated bst files by key, with their styles and sort order
+_generated = {}
+_lock = Lock()
+_template = []
+
+
+def template():
+    """
+    Contents of default.bst, read once, and a hash of it and of this module.
+
+    This module generates the cached files, so they are not reused after any
+    change to it.
+    """
+    with _lock:
+        if not _template:
+            path = os.path.dirname(os.path.realpath(__file__))
+            with open(path + '/default.bst', 'r') as f:
+                data = f.read()
+            digest = hashlib.sha1(data)
+            with open(path + '/bibtex.py', 'rb') as f:
+                digest.update(f.read())
+            _template.extend([data, digest.hexdigest()])
+        return _template
+
 
 class BibTex(object):
 
-    """ Handles BibTex calls and postprocessing of results. """
+    """
+    Handles BibTex calls and postprocessing of results.
+
+    Instances can be reused for many runs, also from several threads.
+    """
+
+    # directory of generated bst files, kept between runs
+    cache = os.path.join(os.path.expanduser('~'), '.cache', 'wos', 'bst')
 
-    def __init__(self, **format_dct):
+    def __init__(self, engine='bibtex', **format_dct):
         """
         Adjust bst file based on dct dictionary.
 
-        dct should hold formatting directives.
+        dct should hold formatting directives. With engine='python' entries
+        are formatted by the Python implementation of the bst file, instead
+        of running latex and bibtex.
         """
         ddct = defaultdict(str)
         ddct.update(format_dct)
-        bst = tempFile(delete=False, suffix='.bst')
-        self.name = os.path.splitext(bst.name)[0]
-        self.shortname = os.path.split(self.name)[1]
-        self.path = os.path.split(bst.name)[0]
+        self.engine = engine
+        # number of latex and bibtex processes run so far
+        self.subprocesses = 0
+        self.lock = Lock()
         self.fdict = ddct
-        with open(self.name + '.tex', 'w') as f:
-            print >>f, r"""
-                \documentclass{{article}}
-                \begin{{document}}
-                \nocite{{*}}
-                \bibliographystyle{{{0}}}
-                \bibliography{{{0}}}
-                \end{{document}}""".format(self.shortname)
-
-        path = os.path.dirname(os.path.realpath(__file__))
-        with open(path + '/default.bst', 'r') as f:
-            template = f.read()
-
+        self.rules = self.numberRules()
+        self.styles, self.reverse, self.bst = self.generate(format_dct)
         if ddct["query"]:
+            self.style = Style(self.styles, short=True)
+        else:
+            self.style = Style(
+                self.styles, byname='name' in ddct["sortBy"],
+                bibitem=ddct["bibitemStyle"] if ddct["genBibitems"] else None)
+
+    def generate(self, format_dct):
+        """
+        Styles, sort order and bst file for format_dct.
+
+        Generated bst files are cached in the cache directory by a key of
+        default.bst, this module and format_dct, so each format is generated
+        only once.
+        """
+        data, digest = template()
+        key = hashlib.sha1(
+            digest + repr(sorted(format_dct.items()))).hexdigest()
+        with _lock:
+            if key in _generated:
+                return _generated[key]
+            cache = self.cache
+            try:
+                os.makedirs(cache)
+            except OSError:
+                if not os.path.isdir(cache):
+                    cache = mkdtemp()
+            name = os.path.join(cache, key)
+            try:
+                with open(name + '.dat', 'rb') as f:
+                    styles, reverse = pickle.load(f)
+                if not os.path.exists(name + '.bst'):
+                    raise IOError(name + '.bst')
+            except:
+                styles, reverse, data = self.adjust(format_dct, data)
+                # write under temporary names first, for concurrent processes
+                for ext, value in (('.bst', data), ('.dat', (styles, reverse))):
+                    f = tempFile('wb', dir=cache, delete=False)
+                    if ext == '.bst':
+                        print >>f, value
+                    else:
+                        pickle.dump(value, f, protocol=-1)
+                    f.close()
+                    os.rename(f.name, name + ext)
+            _generated[key] = styles, reverse, name + '.bst'
+            return _generated[key]
+
+    def adjust(self, format_dct, template):
+        """ Generate styles, sort order and contents of the bst file. """
+        self.styles = {}
+        if self.fdict["query"]:
             template = re.sub(r"\{f.~\}\{vv~\}\{ll\}\{, jj\}", "{ll}", template)
             self.reverse = False
+            # style places are left in the template
+            for key in ('author', 'title', 'journal', 'volume', 'number'):
+                self.styles[key] = ('---' + key + 'style---',
+                                    '---' + key + 'styleend---')
         else:
-            template = self.adjustBst(ddct, format_dct, template)
-        print >>bst, template
-        bst.close()
+            template = self.adjustBst(self.fdict, format_dct, template)
+        return self.styles, self.reverse, template
 
     def adjustBst(self, ddct, format_dct, template):
         """ Adjust bst file to the format given by format_dct. """
@@ -76,6 +180,7 @@ class BibTex(object):
                     start = r'\\' + start + '{'
             template = re.sub("(?s)---"+key+"style---", start, template)
             template = re.sub("(?s)---"+key+"styleend---", end, template)
+            self.styles[key] = (start.replace('\\\\', '\\'), end)
 
         # remove remaining styled places
         template = re.sub(r"(?si)---\w+?style---", "", template)
@@ -107,112 +212,181 @@ class BibTex(object):
 
     def run(self, bibstr):
         """Execute BibTex with entries from bibstr, and retrieve the results."""
-        with open(self.name + '.bib', 'w') as f:
-            print >>f, bibstr
+        return "\n\n".join(self.runBatch(bibstr).values())
+
+    def runBatch(self, bibstr):
+        """
+        Execute BibTex once for all entries from bibstr.
+
+        bibstr may also be a list of entry dictionaries. Returns an ordered
+        dictionary mapping entry IDs to formatted items, in the order given
+        by the style.
+        """
+        if self.engine == 'python':
+            if isinstance(bibstr, basestring):
+                import bibtexparser
+                bibstr = bibtexparser.loads(bibstr).entries
+            return self.postprocessAll(self.style.bbl(bibstr))
+        if not isinstance(bibstr, basestring):
+            import bibtexparser
+            parsed = bibtexparser.loads("")
+            parsed.entries = [dict(e.items()) for e in bibstr]
+            bibstr = bibtexparser.dumps(parsed)
+        # scratch files of this run only
+        path = mkdtemp()
+        bst = os.path.splitext(os.path.basename(self.bst))[0]
         try:
-            os.system('cd {}; pdflatex -interaction=batchmode {} >/dev/null'
-                      .format(self.path, self.shortname))
-            os.system('cd {}; bibtex {} >/dev/null'
-                      .format(self.path, self.shortname))
-            with open(self.name + '.bbl', 'r') as f:
+            with open(os.path.join(path, 'run.tex'), 'w') as f:
+                print >>f, r"""
+                    \documentclass{{article}}
+                    \begin{{document}}
+                    \nocite{{*}}
+                    \bibliographystyle{{{0}}}
+                    \bibliography{{run}}
+                    \end{{document}}""".format(bst)
+            with open(os.path.join(path, 'run.bib'), 'w') as f:
+                print >>f, bibstr
+            with self.lock:
+                self.subprocesses += 2
+            os.system('cd {}; pdflatex -interaction=batchmode run >/dev/null'
+                      .format(pipes.quote(path)))
+            os.system('cd {}; BSTINPUTS={}: bibtex run >/dev/null'.format(
+                pipes.quote(path),
+                pipes.quote(os.path.dirname(self.bst))))
+            with open(os.path.join(path, 'run.bbl'), 'r') as f:
                 data = f.read()
-            self.cleanup('blg', 'aux', 'bib', 'log', 'bbl')
         except:
-            self.cleanup('blg', 'aux', 'bib', 'log', 'bbl')
-            return ""
-        # postprocess data
-        data = re.sub(r"^[\n\r\s]*", "", data)
-        data = re.sub(r"(?<=[^\n])\n", " ", data)
-        data = re.sub(r" +", " ", data)
-        data = re.sub(r"\n", "\n\n", data)
+            return OrderedDict()
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+        return self.postprocessAll(data)
+
+    def postprocessAll(self, data):
+        """ Split .bbl data into items, and postprocess each of them. """
+        data = _LEADING.sub("", data)
+        data = _NEWLINE.sub(" ", data)
+        data = _SPACES.sub(" ", data)
+        items = data.split("\n")
 
         if self.reverse:
-            data = '\n\n'.join(data.split('\n\n')[::-1])
+            items = items[::-1]
 
-        # put HTML code
-        for key, value in _HTML.items():
-            data = re.sub("(?s)start_html_" + key + "_start", value, data)
-            data = re.sub("(?s)end_html_" + key + "_end", "</font>", data)
+        results = OrderedDict()
+        for item in items:
+            # each item starts with the ID of its entry
+            key = _BIBKEY.search(item)
+            if key:
+                item = item[:key.start()] + item[key.end():]
+                key = key.group(1)
+            results[key] = self.postprocess(item)
+        return results
 
-        # handle conditional numbers
+    def postprocess(self, data):
+        """ Turn a single raw BibTex item into its final form. """
+        # split into text, HTML code and numbers in a single pass
+        segments = []
+        last = 0
+        for m in _TOKEN.finditer(data):
+            segments.append([None, data[last:m.start()]])
+            if m.group(2):
+                segments.append([m.group(2), self.html(m.group(3))])
+            else:
+                segments.append(
+                    [None, _HTML[m.group(1)] if m.group(1) else "</font>"])
+            last = m.end()
+        segments.append([None, data[last:]])
 
-        data = "\n\n".join([self.removeNumbers(d) for d in data.split("\n\n")])
-        data = re.sub(r"[A-Z]{2,3}_END", "}", data) \
-            .replace("MR_START", r"\mref{MR").replace("AR_START", r"\arxiv{") \
-            .replace("ZBL_START", r"\zbl{").replace("DOI_START", r"\doi{") \
-            .replace("URL_START", r"\url{")
+        # handle conditional numbers
+        self.removeNumbers(segments)
+        data = "".join([text if kind is None
+                        else _COMMANDS[kind] + text + "}"
+                        for kind, text in segments])
 
         # cleanup data
-        data = re.sub(r"(?s)start_html_(\w+)_start", "", data)
-        data = re.sub(r"(?s)end_html_(\w+)_end", "", data)
-        data = re.sub(r"(?s)\\cprime", r"$'$", data)
-        data = re.sub(r"(?s)\\(bold|Bbb)", r"\bf", data)
-        data = re.sub(r"\{([A-Z])\}", r"\1", data)
+        if "_END" in data:
+            data = _END.sub("}", data)
+        if "_START" in data:
+            data = _START.sub(lambda m: _COMMANDS[m.group(1)], data)
+        if "_html_" in data:
+            data = _HTML_START.sub("", data)
+            data = _HTML_END.sub("", data)
+        if "\\cprime" in data:
+            data = _CPRIME.sub(r"$'$", data)
+        if "\\bold" in data or "\\Bbb" in data:
+            data = _BOLD.sub(r"\bf", data)
+        return _BRACED.sub(r"\1", data)
 
-        return data
+    def html(self, data):
+        """ Put HTML code in place of HTML places. """
+        if "_html_" not in data:
+            return data
+        return _HTML_PLACE.sub(
+            lambda m: _HTML[m.group(1)] if m.group(1) else "</font>", data)
 
-    def removeNumbers(self, data):
-        """ Remove unwanted numbers. """
+    def numberRules(self):
+        """ Decide which numbers to keep, based on formatting directives. """
         d = self.fdict
         p = d["type"]  # search or batch?
-
-        # MR and Zbl
         mrzbl = {'Both': [True, True], 'MR#': [True, False],
                  'Zbl#': [False, True], 'Neither': [False, False]}
-        try:
-            # absolute
-            keep = mrzbl[d[p+"MRZbl"]]
+        option = d[p+"MRZbl"] or ""
+        doi = d[p+"IncludeDOIURL"] or ""
+        return {
+            # absolute, or conditional if None
+            'keep': mrzbl.get(option),
+            'zblIfMR': 'Zbl# if' in option,
+            'zblIfZbl': 'MR# if' in option,
+            'arxiv': d[p+"Arxiv"] != 'Exclude',
+            'noLinks': doi == 'Exclude',
+            'noLinksIfAny': 'arXiv' in doi,
+            'noLinksIfMRZbl': 'Only' in doi and 'arXiv' not in doi,
+            'doiurl': d[p+"DOIURL"] or "",
+        }
+
+    def removeNumbers(self, segments):
+        """ Remove unwanted numbers from segments of an item. """
+        rules = self.rules
+
+        def present(*kinds):
+            return any([kind in kinds for kind, text in segments])
+
+        def remove(*kinds):
+            segments[:] = [s for s in segments if s[0] not in kinds]
+
+        # MR and Zbl
+        keep = rules['keep']
+        if keep:
             if not keep[0]:
-                data = re.sub(r'(?si)MR_START.*?MR_END', '', data)
+                remove('MR')
             if not keep[1]:
-                data = re.sub(r'(?si)ZBL_START.*?ZBL_END', '', data)
-        except:
-            # conditional
-            if re.search("MR_START", data) and 'Zbl# if' in d[p+"MRZbl"]:
-                data = re.sub(r'(?si)ZBL_START.*?ZBL_END', '', data)
-            if re.search("ZBL_START", data) and 'MR# if' in d[p+"MRZbl"]:
-                data = re.sub(r'(?si)ZBL_START.*?ZBL_END', '', data)
+                remove('ZBL')
+        else:
+            if rules['zblIfMR'] and present('MR'):
+                remove('ZBL')
+            if rules['zblIfZbl'] and present('ZBL'):
+                remove('ZBL')
         # arxiv
-        if d[p+"Arxiv"] == 'Exclude':
-                data = re.sub(r'(?si)AR_START.*?AR_END', '', data)
+        if not rules['arxiv']:
+            remove('AR')
         # doi/link
-        something = not not re.search(r'(?si)(MR|ZBL|AR)_START', data)
-        mrorzbl = not not re.search(r'(?si)(MR|ZBL)_START', data)
-        doi = d[p+"IncludeDOIURL"]
-        if doi == 'Exclude' or ('arXiv' in doi and something) or \
-                ('Only' in doi and 'arXiv' not in doi and mrorzbl):
-            # remove doi and link
-            data = re.sub(r'(?si)DOI_START.*?DOI_END', '', data)
-            data = re.sub(r'(?si)URL_START.*?URL_END', '', data)
+        if rules['noLinks'] or \
+                (rules['noLinksIfAny'] and present('MR', 'ZBL', 'AR')) or \
+                (rules['noLinksIfMRZbl'] and present('MR', 'ZBL')):
+            remove('DOI', 'URL')
         # doi or link?
-        doi = d[p+"DOIURL"]
+        doi = rules['doiurl']
         if doi == 'URL':
-            data = re.sub(r'(?si)DOI_START.*?DOI_END', '', data)
-        elif doi == 'DOI#' or ('different' in doi and re.search(
-                r"(?si)URL_START[^\s\n]*?dx\.doi[^\s\n]*?URL_END", data)):
-            data = re.sub(r'(?si)(URL_START.*?URL_END)', '', data)
+            remove('DOI')
+        elif doi == 'DOI#' or ('different' in doi and any([
+                kind == 'URL' and 'dx.doi' in text.lower() and
+                not _SPACE.search(text) for kind, text in segments])):
+            remove('URL')
         elif 'as' in doi:
-            doi = re.search(r'(?si)DOI_START(.*?)DOI_END', data)
-            if doi and doi.group(1):
+            doi = [text for kind, text in segments if kind == 'DOI']
+            if doi and doi[0]:
                 # DOI exists, but should look like URL
-                data = re.sub(r'(?si)(URL_START).*?(URL_END)',
-                              r'\1http://dx.doi.org/{}\2'.format(doi.group(1)),
-                              data)
+                for s in segments:
+                    if s[0] == 'URL':
+                        s[1] = 'http://dx.doi.org/' + doi[0]
                 # remove DOI
-                data = re.sub(r'(?si)DOI_START.*?DOI_END', '', data)
-        return data
-
-    def cleanup(self, *args):
-        """ Remove temporary files. """
-        for l in args:
-            try:
-                os.unlink(self.name + '.' + l)
-            except:
-                pass
-
-    def __del__(self):
-        """ Remove remaining temporary files. """
-        try:
-            self.cleanup('tex', 'bst')
-        except:
-            pass
+                remove('DOI')
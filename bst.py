@@ -0,0 +1,811 @@
+"""
+Python implementation of default.bst.
+
+Produces the same .bbl contents as BibTex run with default.bst adjusted by
+BibTex.adjustBst, without spawning latex and bibtex processes. Crossref and
+macros are not supported, since Web of Science exports do not use them.
+
+Run as a script with a .bib file to compare its results with BibTex.
+"""
+
+import re
+
+
+# control sequences purify$ keeps as letters
+_LETTERS = {'i', 'j', 'oe', 'OE', 'ae', 'AE', 'aa', 'AA', 'o', 'O', 'l', 'L',
+            'ss'}
+
+
+def _field(entry, name):
+    """ Field value with whitespace normalized as BibTex does. """
+    return re.sub(r'\s+', ' ', entry.get(name, '') or '').strip()
+
+
+def _fields(entry):
+    """ Entry with lowercase field names, as BibTex reads them. """
+    return {k.lower() if k not in ('ID', 'ENTRYTYPE') else k: v
+            for k, v in entry.items()}
+
+
+def _closing(s, i):
+    """ Index of the brace closing the one at position i. """
+    depth = 0
+    for j in range(i, len(s)):
+        if s[j] == '{':
+            depth += 1
+        elif s[j] == '}':
+            depth -= 1
+            if not depth:
+                return j
+    return len(s) - 1
+
+
+def _characters(s):
+    """ Split s into text characters, with special characters as one. """
+    chars = []
+    i = 0
+    while i < len(s):
+        if s[i] == '{' and s[i + 1:i + 2] == '\\':
+            j = _closing(s, i)
+            chars.append(s[i:j + 1])
+            i = j + 1
+        else:
+            chars.append(s[i])
+            i += 1
+    return chars
+
+
+def text_length(s):
+    """ BibTex text.length$: braces are not counted. """
+    return len([c for c in _characters(s) if c not in '{}'])
+
+
+def text_prefix(s, n):
+    """ BibTex text.prefix$: first n text characters, braces balanced. """
+    out = []
+    depth = 0
+    for c in _characters(s):
+        if not n:
+            break
+        out.append(c)
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+        else:
+            n -= 1
+    return ''.join(out) + '}' * depth
+
+
+def purify(s):
+    """ BibTex purify$: keep only letters, digits and spaces. """
+    out = []
+    for c in _characters(s):
+        if len(c) > 1:
+            # special character
+            command = re.match(r'\{\\([a-zA-Z]+)', c)
+            if command and command.group(1) in _LETTERS:
+                out.append(command.group(1))
+            rest = c[command.end():] if command else c[2:]
+            out.append(re.sub(r'\\[a-zA-Z]+|[^a-zA-Z0-9]', '', rest))
+        elif c.isspace() or c in '-~':
+            out.append(' ')
+        elif c.isalnum():
+            out.append(c)
+    return ''.join(out)
+
+
+def sortify(s):
+    """ Sorting key used by default.bst. """
+    return purify(s).lower()
+
+
+def title_case(s):
+    """ BibTex change.case$ with "t": lowercase unbraced text. """
+    out = []
+    depth = 0
+    keep = True
+    colon = False
+    for c in _characters(s):
+        if depth or c in '{}':
+            out.append(c)
+            depth += {'{': 1, '}': -1}.get(c, 0)
+            continue
+        if len(c) > 1:
+            # special character
+            if not keep:
+                c = re.sub(r'(\\[a-zA-Z]+)|([A-Z])',
+                           lambda m: m.group(1) or m.group(2).lower(), c)
+        elif not keep:
+            c = c.lower()
+        out.append(c)
+        if c.isspace():
+            keep = colon
+        else:
+            keep = False
+            colon = c == ':'
+    return ''.join(out)
+
+
+def add_period(s):
+    """ BibTex add.period$. """
+    if not s or s.rstrip('}')[-1:] in ('.', '?', '!'):
+        return s
+    return s + '.'
+
+
+def n_dashify(s):
+    """ Turn single dashes into double dashes. """
+    return re.sub(r'(?<!-)-(?!-)', '--', s)
+
+
+def tie_or_space(word, value):
+    """ BibTex tie.or.space.connect. """
+    return word + ('~' if text_length(value) < 3 else ' ') + value
+
+
+def _split(s, pattern):
+    """ Split s at matches of pattern outside braces. """
+    depth = []
+    level = 0
+    for c in s:
+        depth.append(level)
+        level += {'{': 1, '}': -1}.get(c, 0)
+    parts = []
+    last = 0
+    for m in re.finditer(pattern, s):
+        if m.start() >= last and not depth[m.start()]:
+            parts.append(s[last:m.start()])
+            last = m.end()
+    parts.append(s[last:])
+    return parts
+
+
+def split_names(s):
+    """ Names from an author or editor field. """
+    if not s:
+        return []
+    return [n.strip() for n in _split(s, r'(?i)\s+and\s+')]
+
+
+def _words(part):
+    """ Words of a name part, with separators following them. """
+    words = []
+    word = ''
+    depth = 0
+    for c in part:
+        if not depth and (c.isspace() or c in '~-'):
+            if word:
+                words.append([word, ' ' if c.isspace() else c])
+                word = ''
+            elif words and c in '~-':
+                words[-1][1] = c
+            continue
+        depth += {'{': 1, '}': -1}.get(c, 0)
+        word += c
+    if word:
+        words.append([word, ''])
+    return words
+
+
+def _lower(word):
+    """ Check if the word starts with a lowercase letter, as von does. """
+    depth = 0
+    for c in _characters(word):
+        if len(c) > 1:
+            letters = re.sub(r'^\{\\[^a-zA-Z]?', '', c)
+            letters = re.sub(r'[^a-zA-Z]', '', letters)
+            return letters[:1].islower()
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+        elif c.isalpha():
+            return not depth and c.islower()
+    return False
+
+
+def parse_name(name):
+    """ Split name into first, von, last and jr parts, as lists of words. """
+    parts = [p.strip() for p in _split(name, r',')]
+    words = _words(parts[0])
+    first, jr = [], []
+    if len(parts) == 1:
+        lower = [i for i, w in enumerate(words[:-1]) if _lower(w[0])]
+        if lower:
+            first = words[:lower[0]]
+            von = words[lower[0]:lower[-1] + 1]
+            last = words[lower[-1] + 1:]
+        else:
+            first, von, last = words[:-1], [], words[-1:]
+    else:
+        lower = [i for i, w in enumerate(words[:-1]) if _lower(w[0])]
+        end = lower[-1] + 1 if lower else 0
+        von, last = words[:end], words[end:]
+        if len(parts) == 2:
+            first = _words(parts[1])
+        else:
+            jr, first = _words(parts[1]), _words(parts[2])
+    return {'f': first, 'v': von, 'l': last, 'j': jr}
+
+
+def _initial(word):
+    """ Abbreviation of a word. """
+    if word.startswith('{'):
+        return word[:_closing(word, 0) + 1]
+    return word[:1]
+
+
+def format_part(words, short, pre='', post='', between=None):
+    """ Format one part of a name, like a single {...} of format.name$. """
+    if not words:
+        return ''
+    text = ''
+    for n, (word, sep) in enumerate(words):
+        token = _initial(word) if short else word
+        if n < len(words) - 1:
+            if between is not None:
+                token += between
+            else:
+                if short:
+                    token += '.'
+                if sep in ('-', '~'):
+                    token += sep
+                elif n == len(words) - 2 or text_length(token) < 3:
+                    token += '~'
+                else:
+                    token += ' '
+        text += token
+    if post.endswith('~'):
+        # discretionary tie
+        post = post[:-1] + ('~' if text_length(text + post[:-1]) < 3
+                            else ' ')
+    return pre + text + post
+
+
+def format_name(name, spec):
+    """
+    Format name like format.name$.
+
+    spec is a list of (part letter, abbreviate, pre-text, post-text, between)
+    where between is None for default separators.
+    """
+    parts = parse_name(name)
+    return ''.join([format_part(parts[p], short, pre, post, between)
+                    for p, short, pre, post, between in spec])
+
+
+# name formats used by default.bst
+_FULL = [('f', True, '', '.~', None), ('v', False, '', '~', None),
+         ('l', False, '', '', None), ('j', False, ', ', '', None)]
+_LAST = [('l', False, '', '', None)]
+_INITIALS = [('v', True, '', '', ''), ('l', True, '', '', '')]
+_SORT = [('v', False, '', ' ', ' '), ('l', False, '', '', ' '),
+         ('f', False, '  ', '', ' '), ('j', False, '  ', '', ' ')]
+
+
+class Style(object):
+
+    """ Formatting of entries with default.bst, adjusted by BibTex. """
+
+    def __init__(self, styles=None, short=False, byname=False, bibitem=None):
+        """
+        Set up style.
+
+        styles maps style places (author, title, journal, volume, number) to
+        start and end strings. short gives last names only. byname sorts by
+        authors instead of IDs. bibitem is the bibitem style, or None if
+        bibitems are not generated.
+        """
+        self.styles = styles or {}
+        self.names = _LAST if short else _FULL
+        self.byname = byname
+        self.bibitem = bibitem
+
+    def style(self, place, text):
+        """ Wrap text in the style for place. """
+        start, end = self.styles.get(place, ('', ''))
+        return start + text + end
+
+    def bbl(self, entries):
+        """ Return .bbl contents for entries. """
+        entries = [_fields(e) for e in entries]
+        if self.bibitem is not None:
+            labels = self.labels(entries)
+        else:
+            labels = [''] * len(entries)
+        items = sorted(zip(entries, labels), key=self.sort_key)
+        return ''.join([self.entry(e, label) for e, label in items])
+
+    def keys(self, entries):
+        """ Bibitem keys of entries by ID, as bbl makes them for entries. """
+        entries = [_fields(e) for e in entries]
+        if '{id}' in self.bibitem:
+            return {e['ID']: e['ID'] for e in entries}
+        return {e['ID']: label
+                for e, label in zip(entries, self.labels(entries))}
+
+    def sort_key(self, item):
+        """ Sort key of default.bst. """
+        entry = item[0]
+        if not self.byname:
+            # presort3 lacks an argument for its first *, so the year is lost
+            return '    ' + entry['ID']
+        return (self.type_sort(entry) + '    ' +
+                sortify(_field(entry, 'year')) + '    ' +
+                self.title_sort(_field(entry, 'title')))[:250]
+
+    def labels(self, entries):
+        """ Labels from initials and year, made unique with extra letters. """
+        keyed = []
+        for n, e in enumerate(entries):
+            names = self.label_names(e)
+            year = purify(_field(e, 'year'))
+            label = names + year[-2:]
+            sort_label = sortify(names + year[-4:])
+            key = (sort_label + '    ' + self.type_sort(e) + '    ' +
+                   sortify(_field(e, 'year')) + '    ' +
+                   self.title_sort(_field(e, 'title')))[:250]
+            keyed.append((key, n, sort_label, label))
+        keyed.sort()
+        labels = [None] * len(entries)
+        last = None
+        extra = []
+        for key, n, sort_label, label in keyed:
+            if sort_label == last:
+                extra.append(chr(ord(extra[-1] or 'a') + 1))
+            else:
+                extra.append('')
+                last = sort_label
+        for i, (key, n, sort_label, label) in enumerate(keyed):
+            if extra[i] == '' and i + 1 < len(keyed) and extra[i + 1] == 'b':
+                extra[i] = 'a'
+            labels[n] = label + extra[i]
+        return labels
+
+    def label_names(self, entry):
+        """ Names part of the label, as calc.label. """
+        kind = entry.get('ENTRYTYPE', '').lower()
+        fields = ['author']
+        if kind in ('book', 'inbook'):
+            fields = ['author', 'editor']
+        elif kind == 'proceedings':
+            fields = ['editor', 'organization']
+        elif kind == 'manual':
+            fields = ['author', 'organization']
+        for f in fields:
+            value = _field(entry, f)
+            if not value:
+                continue
+            if f == 'organization':
+                return text_prefix(self.chop(value, 'The '), 3)
+            return self.lab_names(value)
+        key = _field(entry, 'key')
+        return text_prefix(key, 3) if key else entry['ID'][:3]
+
+    def lab_names(self, s):
+        """ BibTex format.lab.names. """
+        names = split_names(s)
+        if len(names) == 1:
+            label = format_name(names[0], _INITIALS)
+            if text_length(label) < 2:
+                label = text_prefix(format_name(names[0], _LAST), 3)
+            return label
+        label = ''
+        for n, name in enumerate(names[:3 if len(names) > 4 else 4]):
+            if n == len(names) - 1 and name == 'others':
+                label += '+'
+            else:
+                label += format_name(name, _INITIALS)
+        if len(names) > 4:
+            label += '+'
+        return label
+
+    def type_sort(self, entry):
+        """ Authors, editors or organization used for sorting. """
+        kind = entry.get('ENTRYTYPE', '').lower()
+        fields = ['author']
+        if kind in ('book', 'inbook'):
+            fields = ['author', 'editor']
+        elif kind == 'proceedings':
+            fields = ['editor', 'organization']
+        elif kind == 'manual':
+            fields = ['author', 'organization']
+        for f in fields:
+            value = _field(entry, f)
+            if not value:
+                continue
+            if f == 'organization':
+                return sortify(self.chop(value, 'The '))
+            return self.sort_names(value)
+        return sortify(_field(entry, 'key'))
+
+    def sort_names(self, s):
+        """ BibTex sort.format.names. """
+        names = split_names(s)
+        out = []
+        for n, name in enumerate(names):
+            t = format_name(name, _SORT)
+            if n == len(names) - 1 and t == 'others':
+                out.append('et al')
+            else:
+                out.append(sortify(t))
+        return '   '.join(out)
+
+    def chop(self, s, word):
+        """ BibTex chop.word. """
+        return s[len(word):] if s.startswith(word) else s
+
+    def title_sort(self, title):
+        """ BibTex sort.format.title. """
+        for word in ('The ', 'An ', 'A '):
+            title = self.chop(title, word)
+        return sortify(title)
+
+    def format_names(self, s):
+        """ BibTex format.names. """
+        names = split_names(s)
+        text = ''
+        for n, name in enumerate(names):
+            t = format_name(name, self.names)
+            if not n:
+                text = t
+            elif n < len(names) - 1:
+                text += ', ' + t
+            else:
+                if len(names) > 2:
+                    text += ','
+                if name == 'others':
+                    text += ' et~al.'
+                else:
+                    text += ' and ' + t
+        return text
+
+    def entry(self, e, label):
+        """ Output of a single entry. """
+        out = _Output()
+        out.write('\n' + 'BIBKEY_START' + e['ID'] + 'BIBKEY_END')
+        if self.bibitem is not None:
+            out.write('\\bibitem')
+            if '[' in self.bibitem:
+                out.write('[' + label + ']')
+            out.write('{' + (e['ID'] if '{id}' in self.bibitem else label) +
+                      '}\n')
+        kind = e.get('ENTRYTYPE', 'misc').lower()
+        if kind == 'conference':
+            kind = 'inproceedings'
+        getattr(self, 'entry_' + kind, self.entry_misc)(e, out)
+        # fin.entry
+        out.write(add_period(out.pending))
+        for field, marker in (('mrnumber', 'MR'), ('zbl', 'ZBL'),
+                              ('arxiv', 'AR'), ('doi', 'DOI'),
+                              ('link', 'URL')):
+            value = _field(e, field)
+            if value:
+                out.write(' ' + marker + '_START' + value + marker + '_END')
+        out.write('\n')
+        return out.text()
+
+    def authors(self, e):
+        """ BibTex format.authors. """
+        author = _field(e, 'author')
+        return self.style('author', self.format_names(author)) if author \
+            else ''
+
+    def editors(self, e):
+        """ BibTex format.editors. """
+        editor = _field(e, 'editor')
+        if not editor:
+            return ''
+        many = len(split_names(editor)) > 1
+        return self.style('author', self.format_names(editor) +
+                          (' (eds.)' if many else ' (ed.)'))
+
+    def nonauthor_editors(self, e):
+        """ BibTex format.nonauthor.editors. """
+        editor = _field(e, 'editor')
+        if not editor:
+            return ''
+        many = len(split_names(editor)) > 1
+        return self.format_names(editor) + (', eds.' if many else ', ed.')
+
+    def title(self, e):
+        """ BibTex format.title. """
+        title = _field(e, 'title')
+        return self.style('title', title_case(title)) if title else ''
+
+    def journal_vol_year(self, e):
+        """ BibTex format.journal.vol.year. """
+        journal = _field(e, 'journal')
+        text = ' ' + self.style('journal', journal) if journal else ''
+        volume = _field(e, 'volume')
+        if volume:
+            text += ' ' + self.style('volume', volume)
+        year = _field(e, 'year')
+        if year:
+            text += ' (' + year + ')'
+        return text
+
+    def number(self, e):
+        """ BibTex format.number. """
+        number = _field(e, 'number')
+        return self.style('number', 'no.~' + number) if number else ''
+
+    def date(self, e):
+        """ BibTex format.date. """
+        year, month = _field(e, 'year'), _field(e, 'month')
+        if not year:
+            return month
+        return month + ' ' + year if month else year
+
+    def bookvolume_series_number(self, e):
+        """ BibTex format.bookvolume.series.number. """
+        volume = _field(e, 'volume')
+        series = _field(e, 'series')
+        number = _field(e, 'number')
+        if not volume:
+            text = series
+            if number:
+                text += ', ' if text else ''
+                text += tie_or_space('no.', number)
+            return text
+        text = tie_or_space('vol.', volume)
+        if not number:
+            return series + ', ' + text if series else text
+        if not series:
+            return text
+        return text + ', ' + series + ', ' + tie_or_space('no.', number)
+
+    def edition(self, e, out):
+        """ BibTex format.edition. """
+        edition = _field(e, 'edition')
+        if not edition:
+            return ''
+        if out.mid:
+            return edition.lower() + ' ed.'
+        return title_case(edition) + ' ed.'
+
+    def pages(self, e):
+        """ BibTex format.pages. """
+        return n_dashify(_field(e, 'pages'))
+
+    def book_pages(self, e):
+        """ BibTex format.book.pages. """
+        pages = _field(e, 'pages')
+        if not pages:
+            return ''
+        if re.search(r'[-,+]', pages):
+            return 'pp.~' + n_dashify(pages)
+        return 'p.~' + pages
+
+    def chapter_pages(self, e):
+        """ BibTex format.chapter.pages. """
+        chapter = _field(e, 'chapter')
+        if not chapter:
+            return self.book_pages(e)
+        kind = _field(e, 'type')
+        text = (kind.lower() + ' ' if kind else 'ch.~') + chapter
+        if _field(e, 'pages'):
+            text += ', ' + self.book_pages(e)
+        return text
+
+    def inproc_title(self, e):
+        """ BibTex format.inproc.title.address.editors. """
+        text = _field(e, 'booktitle')
+        if not text:
+            return ''
+        if _field(e, 'address'):
+            text += (' ' if text else '') + '(' + _field(e, 'address') + ')'
+        if _field(e, 'editor'):
+            text += (' ' if text else '') + \
+                '(' + self.nonauthor_editors(e) + ')'
+        return text
+
+    def incoll_title(self, e):
+        """ BibTex format.incoll.title.editors. """
+        text = _field(e, 'booktitle')
+        if not text or not _field(e, 'editor'):
+            return text
+        return text + ' (' + self.nonauthor_editors(e) + ')'
+
+    def thesis_type(self, e, default):
+        """ BibTex format.thesis.type. """
+        kind = _field(e, 'type')
+        return title_case(kind) if kind else default
+
+    def tr_number(self, e):
+        """ BibTex format.tr.number. """
+        kind = _field(e, 'type') or 'Tech. Report'
+        number = _field(e, 'number')
+        return tie_or_space(kind, number) if number else title_case(kind)
+
+    def entry_article(self, e, out):
+        """ BibTex article. """
+        out.output(self.authors(e))
+        out.output(self.title(e))
+        out.output(self.journal_vol_year(e))
+        out.output(self.number(e))
+        out.output(self.pages(e))
+        out.output(_field(e, 'note'))
+
+    def entry_book(self, e, out):
+        """ BibTex book. """
+        out.output(self.authors(e) or self.editors(e))
+        out.output(self.title(e))
+        out.output(self.edition(e, out))
+        out.output(self.bookvolume_series_number(e))
+        out.output(_field(e, 'publisher'))
+        out.output(_field(e, 'address'))
+        out.output(self.date(e))
+        out.output(_field(e, 'note'))
+
+    def entry_booklet(self, e, out):
+        """ BibTex booklet. """
+        out.output(self.authors(e))
+        out.output(self.title(e))
+        out.output(_field(e, 'howpublished'))
+        out.output(_field(e, 'address'))
+        out.output(self.date(e))
+        out.output(_field(e, 'note'))
+
+    def entry_inbook(self, e, out):
+        """ BibTex inbook. """
+        out.output(self.authors(e) or self.editors(e))
+        out.output(self.title(e))
+        out.output(self.edition(e, out))
+        out.output(self.bookvolume_series_number(e))
+        out.output(self.chapter_pages(e))
+        out.output(_field(e, 'publisher'))
+        out.output(_field(e, 'address'))
+        out.output(self.date(e))
+        out.output(_field(e, 'note'))
+
+    def entry_incollection(self, e, out):
+        """ BibTex incollection. """
+        out.output(self.authors(e))
+        out.output(self.title(e))
+        out.output(self.incoll_title(e))
+        out.output(self.bookvolume_series_number(e))
+        out.output(_field(e, 'publisher'))
+        out.output(_field(e, 'address'))
+        out.output(self.edition(e, out))
+        out.output(self.date(e))
+        out.output(_field(e, 'note'))
+        out.output(self.book_pages(e))
+
+    def entry_inproceedings(self, e, out):
+        """ BibTex inproceedings. """
+        out.output(self.authors(e))
+        out.output(self.title(e))
+        out.output(self.inproc_title(e))
+        out.output(self.bookvolume_series_number(e))
+        out.output(_field(e, 'organization'))
+        out.output(_field(e, 'publisher'))
+        out.output(self.date(e))
+        out.output(_field(e, 'note'))
+        out.output(self.book_pages(e))
+
+    def entry_manual(self, e, out):
+        """ BibTex manual. """
+        author = self.authors(e)
+        if author:
+            out.output(author)
+        else:
+            out.output(_field(e, 'organization'))
+            out.output(_field(e, 'address'))
+        out.output(self.title(e))
+        if author:
+            out.output(_field(e, 'organization'))
+            out.output(_field(e, 'address'))
+        elif not _field(e, 'organization'):
+            out.output(_field(e, 'address'))
+        out.output(self.edition(e, out))
+        out.output(self.date(e))
+        out.output(_field(e, 'note'))
+
+    def thesis(self, e, out, default):
+        """ BibTex mastersthesis and phdthesis. """
+        out.output(self.authors(e))
+        out.output(self.title(e))
+        out.output(self.thesis_type(e, default))
+        out.output(_field(e, 'school'))
+        out.output(_field(e, 'address'))
+        out.output(self.date(e))
+        out.output(_field(e, 'note'))
+        out.output(self.book_pages(e))
+
+    def entry_mastersthesis(self, e, out):
+        """ BibTex mastersthesis. """
+        self.thesis(e, out, "Master's thesis")
+
+    def entry_phdthesis(self, e, out):
+        """ BibTex phdthesis. """
+        self.thesis(e, out, "Ph.D. thesis")
+
+    def entry_misc(self, e, out):
+        """ BibTex misc. """
+        out.output(self.authors(e))
+        out.output(self.title(e))
+        out.output(_field(e, 'howpublished'))
+        out.output(self.date(e))
+        out.output(_field(e, 'note'))
+        out.output(self.book_pages(e))
+
+    def entry_proceedings(self, e, out):
+        """ BibTex proceedings. """
+        out.output(self.editors(e) or _field(e, 'organization'))
+        out.output(self.title(e))
+        out.output(self.bookvolume_series_number(e))
+        if _field(e, 'address'):
+            out.output(_field(e, 'address'))
+        if _field(e, 'editor'):
+            out.output(_field(e, 'organization'))
+        out.output(_field(e, 'publisher'))
+        out.output(self.date(e))
+        out.output(_field(e, 'note'))
+
+    def entry_techreport(self, e, out):
+        """ BibTex techreport. """
+        out.output(self.authors(e))
+        out.output(self.title(e))
+        out.output(self.tr_number(e))
+        out.output(_field(e, 'institution'))
+        out.output(_field(e, 'address'))
+        out.output(self.date(e))
+        out.output(_field(e, 'note'))
+
+    def entry_unpublished(self, e, out):
+        """ BibTex unpublished. """
+        out.output(self.authors(e))
+        out.output(self.title(e))
+        out.output(_field(e, 'note'))
+        out.output(self.date(e))
+
+
+class _Output(object):
+
+    """ Output state of default.bst while writing a single entry. """
+
+    def __init__(self):
+        """ Start in before.all state. """
+        self.parts = []
+        self.pending = ''
+        self.mid = False
+
+    def write(self, text):
+        """ BibTex write$. """
+        self.parts.append(text)
+
+    def output(self, s):
+        """ BibTex output: write pending string and keep s for later. """
+        if not s.strip():
+            return
+        self.write(self.pending + ', ' if self.mid else self.pending)
+        self.mid = True
+        self.pending = s
+
+    def text(self):
+        """ Everything written so far. """
+        return ''.join(self.parts)
+
+
+if __name__ == '__main__':
+    # compare with BibTex on a .bib file, tests/fixtures.bib by default
+    import os
+    import sys
+    from bibtex import BibTex
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests',
+                        'fixtures.bib')
+    with open(sys.argv[1] if len(sys.argv) > 1 else path) as f:
+        bibstr = f.read()
+    for options in ({'authorStyle': 'textbf', 'titleStyle': 'textit'},
+                    {'genBibitems': True, 'IncludeDOIURL': 'Exclude'},
+                    {'sortBy': 'name', 'bibitemStyle': '[{id}]',
+                     'genBibitems': True}):
+        expected = BibTex(**options).runBatch(bibstr)
+        found = BibTex(engine='python', **options).runBatch(bibstr)
+        print options, 'same order:', expected.keys() == found.keys()
+        for key in expected:
+            if expected[key] != found.get(key):
+                print 'bibtex:', expected[key]
+                print 'python:', found.get(key)
@@ -0,0 +1,237 @@
+"""
+Compact storage of search results.
+
+Citing papers are kept as Record objects instead of dictionaries, with common
+strings (authors, journals, years) shared between records. Results are saved
+in a versioned format: a header with everything except citing papers, followed
+by citing papers stored as columns of indexes into a table of strings. Citing
+papers are only read from the file when first needed.
+
+Files saved by older versions, holding bibtexparser databases, are converted
+when loaded.
+"""
+
+from array import array
+import pickle
+
+
+# version of the file format
+FORMAT = 2
+
+# strings shared between records
+_strings = {}
+
+
+def _intern(s):
+    """ Shared copy of string s. """
+    return _strings.setdefault(s, s)
+
+
+class Record(object):
+
+    """ Bibtex entry of a citing paper, with dictionary-like access. """
+
+    __slots__ = ('ID', 'ENTRYTYPE', 'author', 'title', 'journal', 'number',
+                 'volume', 'pages', 'year', 'editor', 'booktitle', 'series',
+                 'doi')
+    # fields with values repeated across many records
+    shared = ('ENTRYTYPE', 'author', 'journal', 'year', 'volume', 'editor',
+              'booktitle', 'series')
+
+    def __init__(self, entry=None):
+        """ Copy fields of the entry dictionary. """
+        entry = entry or {}
+        for k in self.__slots__:
+            v = entry.get(k)
+            if v is not None and k in self.shared:
+                v = _intern(v)
+            setattr(self, k, v)
+
+    def __getitem__(self, key):
+        """ Value of field key. """
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        """ Value of field key, or default. """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        """ Check if field key is set. """
+        return self.get(key) is not None
+
+    def keys(self):
+        """ Names of set fields. """
+        return [k for k in self.__slots__ if getattr(self, k) is not None]
+
+    def items(self):
+        """ Set fields with their values. """
+        return [(k, getattr(self, k)) for k in self.keys()]
+
+    def __iter__(self):
+        """ Iterate over names of set fields. """
+        return iter(self.keys())
+
+    def __len__(self):
+        """ Number of set fields. """
+        return len(self.keys())
+
+    def __eq__(self, other):
+        """ Records are equal if all fields are equal. """
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        """ Negation of equality. """
+        return not self == other
+
+    def __repr__(self):
+        """ Show record as a dictionary. """
+        return 'Record({!r})'.format(dict(self.items()))
+
+    def __getstate__(self):
+        """ Field values, for pickling. """
+        return tuple([getattr(self, k) for k in self.__slots__])
+
+    def __setstate__(self, state):
+        """ Restore field values after unpickling. """
+        for k, v in zip(self.__slots__, state):
+            if v is not None and k in self.shared:
+                v = _intern(v)
+            setattr(self, k, v)
+
+
+def record(entry):
+    """ Entry as a Record. """
+    return entry if isinstance(entry, Record) else Record(entry)
+
+
+class Results(dict):
+
+    """
+    Results of a search, reading citing papers from file on first use.
+
+    Until then, 'citingindex' is in results, but not among its keys or items.
+    """
+
+    def __init__(self, data=(), filename=None, offset=None):
+        """ Citing papers are read from filename at offset, if given. """
+        dict.__init__(self, data)
+        self.filename = filename
+        self.offset = offset
+
+    def __missing__(self, key):
+        """ Read citing papers on first use. """
+        if key != 'citingindex' or self.filename is None:
+            raise KeyError(key)
+        return self.read()
+
+    def __contains__(self, key):
+        """ Check for key, including citing papers not read yet. """
+        return (dict.__contains__(self, key) or
+                key == 'citingindex' and self.filename is not None)
+
+    def get(self, key, default=None):
+        """ Value of key, or default, reading citing papers if needed. """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def read(self):
+        """ Read citing papers from the file, unless already read. """
+        if self.filename is not None:
+            with open(self.filename, 'rb') as f:
+                f.seek(self.offset)
+                self['citingindex'] = columns_to_index(pickle.load(f))
+            self.filename = None
+        return self['citingindex']
+
+
+def index_to_columns(index):
+    """ Store citing papers as columns of indexes into a table of strings. """
+    strings = {}
+    table = []
+    columns = []
+    records = index.values()
+    for k in Record.__slots__:
+        column = array('l')
+        for r in records:
+            v = getattr(r, k)
+            if v is None:
+                column.append(-1)
+                continue
+            n = strings.get(v)
+            if n is None:
+                n = strings[v] = len(table)
+                table.append(v)
+            column.append(n)
+        columns.append(column)
+    return {'fields': Record.__slots__, 'strings': table, 'columns': columns}
+
+
+def columns_to_index(data):
+    """ Rebuild citing papers index from columns. """
+    table = data['strings']
+    shared = set(Record.shared)
+    # share strings with records already in memory
+    for k, column in zip(data['fields'], data['columns']):
+        if k in shared:
+            for n in set(column):
+                if n >= 0:
+                    table[n] = _intern(table[n])
+    fields = [k if k in Record.__slots__ else None for k in data['fields']]
+    index = {}
+    for row in zip(*data['columns']):
+        r = Record.__new__(Record)
+        for k in Record.__slots__:
+            setattr(r, k, None)
+        for k, n in zip(fields, row):
+            if n >= 0 and k is not None:
+                setattr(r, k, table[n])
+        index[r.ID] = r
+    return index
+
+
+def upgrade(old):
+    """ Convert results holding bibtexparser databases. """
+    results = Results(old)
+    papers = results['papers']
+    results['papers'] = list(getattr(papers, 'entries', papers))
+    index = {}
+    citing = results.pop('citingbib', [])
+    for e in getattr(citing, 'entries', citing):
+        index[e['ID']] = record(e)
+    results['citingindex'] = index
+    results['version'] = FORMAT
+    return results
+
+
+def save(results, filename):
+    """ Save results in the current format. """
+    # read any citing papers still in the file before overwriting it
+    index = results['citingindex']
+    header = {k: v for k, v in results.items() if k != 'citingindex'}
+    header['version'] = FORMAT
+    with open(filename, 'wb') as f:
+        pickle.dump(header, f, protocol=-1)
+        pickle.dump(index_to_columns(index), f, protocol=-1)
+
+
+def load(filename, lazy=True):
+    """ Load results saved in any format, citing papers only when needed. """
+    with open(filename, 'rb') as f:
+        header = pickle.load(f)
+        if header.get('version') is None:
+            return upgrade(header)
+        if header['version'] > FORMAT:
+            raise ValueError('Unknown results format: ' +
+                             str(header['version']))
+        results = Results(header, filename, f.tell())
+    if not lazy:
+        results.read()
+    return results
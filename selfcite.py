@@ -0,0 +1,156 @@
+"""
+Self-citations computed offline from author lists of stored papers.
+
+Web of Science counts citations without self-citations from the citing papers
+of its citation report. Here a citing paper is a self-citation if one of its
+authors is one of the given authors, so counts can be recomputed from saved
+results for any author name variant, without fetching anything.
+
+Names are matched by last name and given names, where an initial matches any
+given name starting with it: 'Doe, J.' matches 'Doe, John' and 'Doe, J. A.',
+but not 'Doe, Jane Q.' when searching for 'Doe, John'.
+"""
+
+import re
+import unicodedata
+
+from bst import parse_name, purify, split_names
+
+
+def _ascii(s):
+    """ Name without accents, as plain ASCII. """
+    if isinstance(s, str):
+        s = s.decode('utf-8', 'ignore')
+    s = unicodedata.normalize('NFKD', s)
+    return s.encode('ascii', 'ignore')
+
+
+def normalize(name):
+    """
+    Last name and given names of name, lowercase without accents.
+
+    Given names are a tuple of words, with initials such as 'J.' or 'JA' split
+    into single letters.
+    """
+    parts = parse_name(_ascii(name).strip())
+    last = purify(' '.join([w for w, s in parts['v'] + parts['l']]))
+    given = []
+    for word, sep in parts['f']:
+        for w in re.split(r'[.\s]+', word):
+            w = purify(w)
+            if w.isupper() and len(w) <= 3 and ',' in name:
+                # initials written together, as in field tagged exports
+                given.extend(w.lower())
+            elif w:
+                given.append(w.lower())
+    return ''.join(last.lower().split()), tuple(given)
+
+
+def compatible(given, other):
+    """ Check if given names could belong to the same person. """
+    for a, b in zip(given, other):
+        if not (a.startswith(b) or b.startswith(a)):
+            return False
+    return True
+
+
+def query_authors(query):
+    """ Author names searched by a Web of Science query, e.g. AU=doe,j*. """
+    names = []
+    # each AU field ends before a parenthesis or the next field tag
+    for m in re.finditer(r'\bAU\s*=\s*\(?([^()=]*?)(?=\s*\)|\s+\w+\s*=|$)',
+                         query or '', re.I):
+        for name in re.split(r'\s+(?:OR|AND|NOT)(?=\s|$)', m.group(1),
+                             flags=re.I):
+            name = name.strip().strip('"').replace('*', '').strip()
+            if not name:
+                continue
+            if ',' not in name and len(name.split()) > 1:
+                # Last First, as Web of Science also accepts
+                words = name.split()
+                name = words[0] + ', ' + ' '.join(words[1:])
+            names.append(name)
+    return names
+
+
+def paper_ids(paper):
+    """ IDs of papers citing the paper. """
+    ids = paper.get('citing', ())
+    if isinstance(ids, basestring):
+        # comma separated string from old data files
+        ids = [i for i in ids.split(',') if i]
+    return ids
+
+
+class SelfCitations(object):
+
+    """ Index of author names of papers and citing papers in results. """
+
+    def __init__(self, results):
+        """ Index author names of all papers in results. """
+        self.results = results
+        # last name -> given names -> IDs of papers
+        self.papers = {}
+        for paper in results['papers']:
+            self.add(paper, self.papers)
+        self.citing = {}
+        for entry in results['citingindex'].values():
+            self.add(entry, self.citing)
+
+    def add(self, entry, index):
+        """ Add authors of entry to index. """
+        for name in split_names(entry.get('author', '')):
+            last, given = normalize(name)
+            if last:
+                index.setdefault(last, {}).setdefault(given, set()).add(
+                    entry['ID'])
+
+    def lookup(self, author, index):
+        """ IDs of papers in index by author. """
+        last, given = normalize(author)
+        ids = set()
+        for other, found in index.get(last, {}).items():
+            if compatible(given, other):
+                ids.update(found)
+        return ids
+
+    def authors(self):
+        """ Names searched by the query, or the most frequent author. """
+        names = query_authors(self.results.get('query'))
+        if names or not self.papers:
+            return names
+        counts = [(len(ids), last, given)
+                  for last, variants in self.papers.items()
+                  for given, ids in variants.items()]
+        count, last, given = max(counts)
+        return [last + ', ' + ' '.join(given)]
+
+    def self_citing(self, authors=None):
+        """ IDs of citing papers by any of authors. """
+        ids = set()
+        for author in authors or self.authors():
+            ids.update(self.lookup(author, self.citing))
+        return ids
+
+    def update(self, authors=None):
+        """
+        Recompute citations without self-citations of authors, for all papers
+        and in totals. Returns IDs of self-citing papers.
+        """
+        own = self.self_citing(authors)
+        noself = set()
+        total = 0
+        for paper in self.results['papers']:
+            ids = [i for i in paper_ids(paper) if i not in own]
+            paper['citednoself'] = str(len(ids))
+            noself.update(ids)
+            total += len(ids)
+        self.results['citing'] = noself
+        self.results['citationsnoself'] = str(total)
+        return own
+
+
+def update(results, authors=None):
+    """ Recompute citations without self-citations of authors in results. """
+    return SelfCitations(results).update(authors)
+
@@ -0,0 +1,59 @@
+""" Parity of the Python engine with BibTeX running default.bst. """
+
+from distutils.spawn import find_executable
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bibtex import BibTex
+
+try:
+    import bibtexparser
+except ImportError:
+    bibtexparser = None
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'fixtures.bib')
+
+# formatting options used by WebOfScience.latex, writers and batch lists
+OPTIONS = [
+    {'authorStyle': 'textbf', 'titleStyle': 'textit'},
+    {'genBibitems': True, 'IncludeDOIURL': 'Exclude'},
+    {'sortBy': 'name', 'bibitemStyle': '[{id}]', 'genBibitems': True},
+    {'sortBy': 'oldest', 'MRZbl': 'Both', 'Arxiv': 'Include',
+     'DOIURL': 'DOI#'},
+    {'html': True, 'authorStyle': 'textbf', 'titleStyle': 'textit'},
+    {'query': True},
+]
+
+
+@unittest.skipIf(bibtexparser is None, 'bibtexparser is not installed')
+@unittest.skipIf(not find_executable('bibtex') or
+                 not find_executable('pdflatex'),
+                 'bibtex and pdflatex are not installed')
+class ParityTest(unittest.TestCase):
+
+    """ Compare both engines on every entry of the fixture corpus. """
+
+    @classmethod
+    def setUpClass(cls):
+        """ Read the fixture corpus. """
+        with open(FIXTURES) as f:
+            cls.bibstr = f.read()
+
+    def test_parity(self):
+        """ Same items in the same order for all options. """
+        for options in OPTIONS:
+            expected = BibTex(**options).runBatch(self.bibstr)
+            found = BibTex(engine='python', **options).runBatch(self.bibstr)
+            self.assertEqual(len(expected), self.bibstr.count('\n@') + 1)
+            self.assertEqual(expected.keys(), found.keys(), options)
+            for key in expected:
+                self.assertEqual(expected[key], found[key],
+                                 '{} {}'.format(options, key))
+
+
+if __name__ == '__main__':
+    unittest.main()
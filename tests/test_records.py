@@ -0,0 +1,103 @@
+""" Saving and loading results in the versioned format. """
+
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import records
+
+
+class Database(object):
+
+    """ Entries held as by a bibtexparser database. """
+
+    def __init__(self, entries):
+        """ Keep the list of entries. """
+        self.entries = entries
+
+
+CITING = [
+    {'ID': '000001', 'ENTRYTYPE': 'article', 'author': 'Doe, John',
+     'title': '{First}', 'journal': 'J. Math.', 'year': '2001',
+     'volume': '1', 'pages': '1--10', 'link': 'http://example.org'},
+    {'ID': '000002', 'ENTRYTYPE': 'inproceedings', 'author': 'Roe, Jane',
+     'title': '{Second}', 'booktitle': 'Proceedings', 'year': '2001',
+     'doi': '10.5555/2'},
+]
+
+PAPERS = [
+    {'ID': '000010', 'ENTRYTYPE': 'article', 'author': 'Doe, John',
+     'title': '{Cited}', 'journal': 'J. Math.', 'year': '2000',
+     'cited': '2', 'citednoself': '1', 'citing': '000001,000002,'},
+]
+
+
+class RecordsTest(unittest.TestCase):
+
+    """ Round trips of results through files. """
+
+    def setUp(self):
+        """ Results of an old version in a temporary directory. """
+        self.path = tempfile.mkdtemp()
+        self.name = os.path.join(self.path, 'results.dat')
+        with open(self.name, 'wb') as f:
+            pickle.dump({'query': 'AU=doe,j*', 'number': '1',
+                         'papers': Database(PAPERS),
+                         'citingbib': Database(CITING),
+                         'errors': []}, f)
+
+    def tearDown(self):
+        """ Remove the temporary directory. """
+        shutil.rmtree(self.path)
+
+    def test_upgrade(self):
+        """ Old results are converted when loaded. """
+        results = records.load(self.name)
+        self.assertEqual(results['version'], records.FORMAT)
+        self.assertEqual(results['papers'], PAPERS)
+        self.assertNotIn('citingbib', results)
+        self.assertEqual(sorted(results['citingindex']), ['000001', '000002'])
+        record = results['citingindex']['000002']
+        self.assertIsInstance(record, records.Record)
+        self.assertEqual(record['booktitle'], 'Proceedings')
+        # fields not kept for citing papers
+        self.assertNotIn('link', results['citingindex']['000001'])
+
+    def test_round_trip(self):
+        """ Saved results load the same, with citing papers read lazily. """
+        results = records.load(self.name)
+        records.save(results, self.name)
+        loaded = records.load(self.name)
+        self.assertEqual(loaded['version'], records.FORMAT)
+        self.assertEqual(loaded['papers'][0]['citing'], '000001,000002,')
+        self.assertEqual(loaded['query'], 'AU=doe,j*')
+        # citing papers are not read yet
+        self.assertNotIn('citingindex', loaded.keys())
+        self.assertIn('citingindex', loaded)
+        self.assertEqual(loaded.get('citingindex'), results['citingindex'])
+        self.assertIn('citingindex', loaded.keys())
+
+    def test_lazy(self):
+        """ Citing papers are read on first use, or at once if not lazy. """
+        records.save(records.load(self.name), self.name)
+        loaded = records.load(self.name)
+        self.assertIsNotNone(loaded.filename)
+        index = loaded['citingindex']
+        self.assertIsNone(loaded.filename)
+        self.assertIs(loaded.read(), index)
+        self.assertIsNone(records.load(self.name, lazy=False).filename)
+
+    def test_newer_format(self):
+        """ Results saved by a newer version are rejected. """
+        with open(self.name, 'wb') as f:
+            pickle.dump({'version': records.FORMAT + 1}, f)
+        self.assertRaises(ValueError, records.load, self.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
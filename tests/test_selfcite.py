@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+""" Matching of author names for self-citations. """
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from selfcite import compatible, normalize, query_authors, update
+
+
+class NamesTest(unittest.TestCase):
+
+    """ Normalized names and their matching. """
+
+    def same(self, name, other):
+        """ Check if names could belong to the same person. """
+        (last, given), (last2, given2) = normalize(name), normalize(other)
+        return last == last2 and compatible(given, given2)
+
+    def test_initials(self):
+        """ Initials written together or with periods. """
+        self.assertEqual(normalize('SIUDEJA, BA'), ('siudeja', ('b', 'a')))
+        self.assertEqual(normalize('Siudeja, B. A.'), ('siudeja', ('b', 'a')))
+        self.assertTrue(self.same('SIUDEJA, BA', 'Siudeja, B. A.'))
+        self.assertTrue(self.same('Siudeja, B.', 'Siudeja, Bartlomiej'))
+        self.assertTrue(self.same('Siudeja, B', 'Siudeja, Bartlomiej A.'))
+
+    def test_accents(self):
+        """ Accented names match plain ASCII ones. """
+        self.assertEqual(normalize(u'Bañuelos, Rodrigo'),
+                         ('banuelos', ('rodrigo',)))
+        self.assertEqual(normalize('Ba\xc3\xb1uelos, R.'),
+                         ('banuelos', ('r',)))
+        self.assertTrue(self.same(u'Müller, Karl', 'Muller, K'))
+
+    def test_von_jr(self):
+        """ von parts belong to the last name, jr parts are ignored. """
+        self.assertEqual(normalize('van der Berg, Anna'),
+                         ('vanderberg', ('anna',)))
+        self.assertEqual(normalize('Anna van der Berg'),
+                         ('vanderberg', ('anna',)))
+        self.assertEqual(normalize('Doe, Jr., John'), ('doe', ('john',)))
+        self.assertTrue(self.same('Doe, Jr., John', 'Doe, J.'))
+
+    def test_different(self):
+        """ Different given or last names do not match. """
+        self.assertFalse(self.same('Doe, Jane', 'Doe, John'))
+        self.assertFalse(self.same('Doe, Jane Q.', 'Doe, J. A.'))
+        self.assertFalse(self.same('Doe, John', 'Roe, John'))
+        self.assertTrue(self.same('Doe, J.', 'Doe, Jane'))
+
+
+class QueryTest(unittest.TestCase):
+
+    """ Author names searched by queries. """
+
+    def test_authors(self):
+        """ Names from AU fields only. """
+        self.assertEqual(query_authors('AU=doe,j*'), ['doe,j'])
+        self.assertEqual(query_authors('AU=siudeja,b* AND PY=2010'),
+                         ['siudeja,b'])
+        self.assertEqual(query_authors('TI=spectral AND AU=doe,j'), ['doe,j'])
+        self.assertEqual(
+            query_authors('AU=(siudeja,b* OR banuelos,r*) AND TI=spectral'),
+            ['siudeja,b', 'banuelos,r'])
+        self.assertEqual(query_authors('AU=doe,j OR AU=roe,j'),
+                         ['doe,j', 'roe,j'])
+        self.assertEqual(query_authors('AU=doe,j AND NOT PY=2001'), ['doe,j'])
+        self.assertEqual(query_authors('au = Doe John'), ['Doe, John'])
+        self.assertEqual(query_authors('TI=spectral'), [])
+        self.assertEqual(query_authors(None), [])
+
+
+class UpdateTest(unittest.TestCase):
+
+    """ Counts without self-citations. """
+
+    def test_update(self):
+        """ Citing papers by searched authors are not counted. """
+        citing = {
+            '1': {'ID': '1', 'author': 'DOE, J'},
+            '2': {'ID': '2', 'author': 'Doe, Jane and Roe, Richard'},
+            '3': {'ID': '3', 'author': 'Roe, R. and Doe, J. A.'},
+        }
+        results = {
+            'query': 'AU=doe,j* AND PY=2010',
+            'papers': [{'ID': '10', 'author': 'Doe, John',
+                        'citing': ('1', '2')},
+                       {'ID': '11', 'author': 'Doe, John and Roe, Richard',
+                        'citing': '2,3,'}],
+            'citingindex': citing,
+        }
+        self.assertEqual(update(results, ['Doe, John']), set(['1', '3']))
+        self.assertEqual([p['citednoself'] for p in results['papers']],
+                         ['1', '1'])
+        self.assertEqual(results['citationsnoself'], '2')
+        self.assertEqual(results['citing'], set(['2']))
+        # names searched by the query
+        self.assertEqual(update(results), set(['1', '2', '3']))
+        self.assertEqual(results['citationsnoself'], '0')
+
+
+if __name__ == '__main__':
+    unittest.main()
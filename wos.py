@@ -8,63 +8,221 @@ Call search function with the following inputs:
     Web of Science query (e.g. AU=Last,F* for an author search)
     name of the PDF file to be generated
     new (boolean) - force new databse fetch, or use old data if exists
+    refresh (boolean) - fetch again only papers with changed citation counts
     full (boolean) - list all citing papers or just the counts for each paper
+    engine ('bibtex' or 'python') - format entries with BibTeX, or in Python
+    workers (integer) - number of Chrome browsers fetching papers in parallel
+    bulk (boolean) - export citing papers for all papers at once, in chunks
+    base_url - address of Web of Science, e.g. of a local wosserver.py
+    trace - name of a JSON-lines file recording every timed step and counter
+    fast (boolean) - headless Chrome without images, fonts, stylesheets and
+        analytics, visiting papers in a single reused tab
+    formats - list of report formats: 'pdf', 'json', 'html' or 'md'
+    stream (boolean) - format papers for LaTeX while other papers are fetched
+    selfcite (boolean or list of names) - count self-citations of the searched
+        (or listed) authors from author lists of saved papers, offline
 
 BibTex data might not be available for some papers. These will be listed at the
 end of the PDF file.
+
+Fetched papers are saved to name.part as they arrive, so an interrupted fetch
+resumes where it stopped when search is called again.
+
+The same options are available from the command line, see python wos.py -h.
+Selenium and Chrome are only started when papers are fetched, so reports are
+rebuilt from saved results quickly.
+
+Call batch function with a list of (query, name, options) tuples to run several
+searches, e.g. for a whole department. Citing papers are kept in one store
+shared by all searches, so they are not exported again for each author.
 """
 
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.support.ui import Select
-from time import sleep
+from contextlib import contextmanager
+from tempfile import mkdtemp
+from time import sleep, time
+import hashlib
+import json
 import os
+import pickle
+import re
+import shutil
+import sys
+
+from bst import _closing
+import records
+import selfcite
 
-import bibtexparser
+
+def selenium():
+    """
+    Import Selenium names used by WebOfScience, on first use.
+
+    Reports rebuilt from saved results never start a browser, so they do not
+    pay for importing Selenium.
+    """
+    global webdriver, Keys, ActionChains, Select, WebDriverWait, EC, By, \
+        DesiredCapabilities, TimeoutException
+    from selenium import webdriver
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.common.action_chains import ActionChains
+    from selenium.webdriver.support.ui import Select, WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.desired_capabilities import \
+        DesiredCapabilities
+    from selenium.common.exceptions import TimeoutException
 
 
 # TODO
-#   add argparse
 #   separate tex template
 
+def title_key(title):
+    """ Normalize paper title for matching papers between runs. """
+    return re.sub(r'\W', '', title).lower()
+
+
+# WOS number in a link to a full record
+_WOS = re.compile(r'WOS(?::|%3A)(\d+)', re.I)
+
+
+def paper_key(title, url, seen):
+    """
+    Key of a paper on the results pages, for matching papers between runs.
+
+    This is the WOS number in url, if it has one. Otherwise it is the title,
+    numbered if an earlier paper counted in seen had the same title, so papers
+    like 'Preface' are told apart by their position in the list.
+    """
+    m = _WOS.search(url or '')
+    if m:
+        return m.group(1)
+    key = title_key(title)
+    n = seen.get(key, 0)
+    seen[key] = n + 1
+    return key + '#{}'.format(n) if n else key
+
+
+def reference_keys(references):
+    """ Keys identifying papers in cited references of a bibtex entry. """
+    keys = set(d.rstrip('.').lower()
+               for d in re.findall(r'DOI \[?([^\s,\]]+)', references))
+    keys.update(re.findall(r'(\d{4}), [^,\n]*, V(\w+), P(\w+)', references))
+    return keys
+
+
+def paper_keys(entry):
+    """ Keys under which the paper may appear in cited references. """
+    keys = set()
+    if entry.get('doi'):
+        keys.add(entry['doi'].lower())
+    page = re.match(r'\w+', entry.get('pages', ''))
+    if entry.get('year') and entry.get('volume') and page:
+        keys.add((entry['year'], entry['volume'], page.group()))
+    return keys
+
+
 class WebOfScience(object):
 
     """ Walk through Web of Science website. """
 
-    def __init__(self):
-        """ Initialize Chrome driver. """
-        path = os.getcwd()
+    # maximal number of records in a single export
+    chunk = 500
+    base_url = "http://apps.webofknowledge.com"
+    # resources not loaded in fast mode
+    blocked = ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.ico', '*.css',
+               '*.woff', '*.woff2', '*.ttf', '*.otf', '*google-analytics.com*',
+               '*googletagmanager.com*', '*doubleclick.net*', '*newrelic.com*',
+               '*nr-data.net*', '*hotjar.com*', '*pendo.io*']
+
+    def __init__(self, path=None, timeout=30, base_url=None, trace=None,
+                 fast=False):
+        """
+        Prepare Chrome driver, saving downloads to path.
+
+        Chrome is started when the driver is first used. Without path,
+        downloads go to a temporary directory of this instance, removed by
+        close. Waits for pages and downloads give up after timeout seconds.
+        Searches start at base_url, which defaults to the Web of Science site.
+        Timings and counters are also written to trace file, if given.
+
+        With fast, Chrome runs headless, does not wait for subresources,
+        skips blocked resources and visits all papers in a single tab.
+        """
+        # remove download directory on close only if it was created here
+        self.own_path = path is None
+        self.path = mkdtemp(prefix='wos-') if path is None else path
+        self.timeout = timeout
+        self.fast = fast
+        if base_url:
+            self.base_url = base_url
+        self.stats = Stats(trace)
+        self.checkpoint = None
+        self.previous = {}
+        self.journals = None
+        # bibtex of citing papers, indexed by their references
+        self.store = Store()
+        # formats papers while fetching, if set
+        self.formatter = None
+        self._driver = None
+        self.results = {
+            'citing': set(),
+            'papers': [],
+            'citingindex': {},
+            'errors': [],
+        }
+
+    @property
+    def driver(self):
+        """ Chrome driver, started on first use. """
+        if self._driver is None:
+            with self.stats.timed('browser start'):
+                self._driver = self.start()
+        return self._driver
+
+    def start(self):
+        """ Start Chrome driver. """
+        selenium()
+        cwd = os.getcwd()
         chrome_options = webdriver.ChromeOptions()
         prefs = {
-            "download": {"default_directory": path,
-                         "directory_upgrade": True,
-                         "extensions_to_open": ""},
-            "switches": ["-silent", "--disable-logging"],
-            "chromeOptions": {"args": ["-silent", "--disable-logging"]}
+            "download.default_directory": self.path,
+            "download.prompt_for_download": False,
+            "download.directory_upgrade": True,
+            "download.extensions_to_open": "",
         }
+        chrome_options.add_argument("--silent")
+        chrome_options.add_argument("--disable-logging")
+        chrome_options.add_argument("--log-level=3")
+        capabilities = DesiredCapabilities.CHROME.copy()
+        if self.fast:
+            prefs["profile.managed_default_content_settings.images"] = 2
+            for argument in ("--headless", "--disable-gpu", "--mute-audio",
+                             "--disable-extensions", "--no-first-run",
+                             "--blink-settings=imagesEnabled=false"):
+                chrome_options.add_argument(argument)
+            # return from get once the DOM is ready
+            capabilities["pageLoadStrategy"] = "eager"
         chrome_options.add_experimental_option("prefs", prefs)
         from sys import platform
         self.platform = platform
         try:
-            driver = webdriver.Chrome(chrome_options=chrome_options)
+            driver = webdriver.Chrome(chrome_options=chrome_options,
+                                      desired_capabilities=capabilities)
         except:
-            driver = webdriver.Chrome(executable_path=path+'/chromedriver',
-                                      chrome_options=chrome_options)
+            driver = webdriver.Chrome(executable_path=cwd+'/chromedriver',
+                                      chrome_options=chrome_options,
+                                      desired_capabilities=capabilities)
         driver.implicitly_wait(5)
-        self.driver = driver
-        self.results = {
-            'citing': set(),
-            'papers': bibtexparser.loads(""),
-            'citingbib': bibtexparser.loads(""),
-            'errors': [],
-        }
+        self._driver = driver
+        if self.fast:
+            self.prepare()
+        return driver
 
     def search(self, query):
         """ Execute main search. """
         self.results['query'] = query
         driver = self.driver
-        driver.get("http://apps.webofknowledge.com")
+        driver.get(self.base_url)
 
         # activate Advanced Search
         driver.find_element_by_class_name('icon-dd-active-block-search').click()
@@ -83,14 +241,102 @@ class WebOfScience(object):
         ActionChains(self.driver).move_to_element(link) \
             .key_down(CTRL).key_down(Keys.SHIFT).click() \
             .key_up(CTRL).key_up(Keys.SHIFT).perform()
-        sleep(0.5)
+        self.wait(lambda d: len(d.window_handles) > len(old), 'new tab')
         # find new tab
         new = set(self.driver.window_handles)
         new.difference_update(old)
         self.driver.switch_to_window(new.pop())
+        if self.fast:
+            self.prepare()
+
+    def devtools(self, command, **params):
+        """ Send Chrome DevTools Protocol command to the current tab. """
+        self.driver.command_executor._commands['send_command'] = \
+            ('POST', '/session/$sessionId/chromium/send_command')
+        return self.driver.execute(
+            'send_command', {'cmd': command, 'params': params})
+
+    def prepare(self):
+        """ Allow headless downloads and block resources in current tab. """
+        self.devtools('Page.setDownloadBehavior', behavior='allow',
+                      downloadPath=self.path)
+        self.devtools('Network.enable')
+        self.devtools('Network.setBlockedURLs', urls=self.blocked)
+
+    def wait(self, condition, what, timeout=None):
+        """ Wait until condition holds, and record how long it took. """
+        start = time()
+        result = WebDriverWait(self.driver, timeout or self.timeout, 0.1) \
+            .until(condition)
+        self.stats.add('wait ' + what, time() - start)
+        return result
+
+    def download(self, ext, before, timeout=None):
+        """
+        Wait until savedrecs file is fully downloaded, return its path.
+
+        Only files not among before, the names present when the download was
+        requested, are taken. Chrome gives new downloads unique names, so
+        files left by earlier requests are never read again.
+        """
+        pattern = re.compile(r'savedrecs(?: \(\d+\))?\.' + ext + '$')
+        start = time()
+        path = None
+        size = -1
+        while True:
+            # Chrome renames the file once the download is complete
+            if path is None:
+                new = [n for n in os.listdir(self.path)
+                       if pattern.match(n) and n not in before]
+                if new:
+                    path = os.path.join(self.path, min(new, key=len))
+            if path is not None:
+                if os.path.getsize(path) == size:
+                    break
+                size = os.path.getsize(path)
+            if time() - start > (timeout or self.timeout):
+                raise TimeoutException('Download timed out: savedrecs.{} in '
+                                       '{}'.format(ext, self.path))
+            slept = time()
+            sleep(0.1)
+            self.stats.add('sleep', time() - slept)
+        self.stats.add('download ' + ext, time() - start, bytes=size)
+        self.stats.count('download bytes', size)
+        return path
+
+    @contextmanager
+    def downloaded(self, ext, before):
+        """ Open the downloaded file for reading, and remove it afterwards. """
+        path = self.download(ext, before)
+        try:
+            with open(path) as f:
+                yield f
+        finally:
+            os.unlink(path)
+
+    def send(self):
+        """
+        Click Send button of the export form, once it is clickable.
+
+        Returns names of files in the download directory before sending.
+        """
+        button = self.wait(EC.element_to_be_clickable((
+            By.XPATH, "//span[@class='quickoutput-action']"
+            "/input[@title='Send']")), 'send button')
+        before = set(os.listdir(self.path))
+        button.click()
+        return before
 
-    def report(self):
-        """ Get report data and citing papers. """
+    def report(self, bulk=False, noself=True):
+        """
+        Get report data and citing papers.
+
+        With bulk, bibtex of all citing papers, self-citations included, is
+        exported here in chunks, so papers can find their citing papers without
+        exporting them again. Without noself, the list of citing papers without
+        self-citations is not exported, as they are computed from author lists
+        later.
+        """
         driver = self.driver
         el = driver.find_element_by_xpath("//a[@alt='View Citation Report']")
         self.open_in_tab(el)
@@ -100,65 +346,222 @@ class WebOfScience(object):
         self.results['citationsnoself'] = \
             driver.find_element_by_id('TOTAL_TC_NO_SC').text
         self.results['h-index'] = driver.find_element_by_id('H_INDEX').text
-        driver.find_element_by_id('GRAND_TOTAL_TC3').click()
-
-        # get list of citing papers as txt, then scrape for UT WOS:numbers
-        citing = driver.find_element_by_id('hitCount.top').text
-        select = Select(driver.find_element_by_name('saveToMenu'))
-        select.select_by_value("other")
-        driver.find_element_by_name('value(record_select_type)').click()
-        driver.find_element_by_name('markFrom').send_keys('1')
-        driver.find_element_by_name('markTo').send_keys(citing)
-        select = Select(driver.find_element_by_id('saveOptions'))
-        select.select_by_value("fieldtagged")
-        sleep(0.5)
-        driver.find_element_by_xpath(
-            "//span[@class='quickoutput-action']/input[@title='Send']").click()
-        sleep(5)  # wait for download to finish
-        papers = set()
-        with open('savedrecs.txt', 'r') as f:
-            for line in f.readlines():
-                if 'UT WOS:' in line:
-                    papers.add(line[7:-1])
-        self.results['citing'] = papers
-        os.unlink('savedrecs.txt')
+        if noself:
+            driver.find_element_by_id('GRAND_TOTAL_TC3').click()
+            self.results['citing'] = set(self.citing_ids())
+            if bulk:
+                driver.back()
+        if bulk:
+            # all citing papers, so papers with self-citations are found too
+            driver.find_element_by_id('GRAND_TOTAL_TC2').click()
+            papers = self.citing_ids()
+            self.bulk_export(len(papers), papers)
         driver.close()
         driver.switch_to_window(self.main)
 
-    def papers(self):
-        """ Fetch data for all papers. """
+    def citing_ids(self):
+        """ WOS numbers of all papers in the current list, in its order. """
+        count = self.driver.find_element_by_id('hitCount.top').text
+        papers = []
+        # get list of papers as txt, then scrape for UT WOS:numbers
+        with self.export('txt', count, fields=False) as f:
+            for line in f:
+                if 'UT WOS:' in line:
+                    papers.append(line[7:].strip())
+        return papers
+
+    @contextmanager
+    def export(self, ext, last, first=1, fields=True):
+        """ Export records first to last from the current list, as a file. """
+        select = Select(self.driver.find_element_by_name('saveToMenu'))
+        select.select_by_value("other")
+        self.driver.find_element_by_name('value(record_select_type)').click()
+        for name, value in (('markFrom', first), ('markTo', last)):
+            element = self.driver.find_element_by_name(name)
+            element.clear()
+            element.send_keys(str(value))
+        if fields:
+            select = Select(
+                self.driver.find_element_by_name('fields_selection'))
+            select.select_by_index(2)
+        select = Select(self.driver.find_element_by_id('saveOptions'))
+        select.select_by_value("bibtex" if ext == 'bib' else "fieldtagged")
+        with self.downloaded(ext, self.send()) as f:
+            yield f
+
+    def bulk_export(self, number, ids=None):
+        """
+        Export bibtex of all citing papers, and store them.
+
+        Chunks of the list of ids (in the order of the export) that are all in
+        the store already are not exported again.
+        """
+        import bibtexparser
+        for first in range(1, number + 1, self.chunk):
+            last = min(first + self.chunk - 1, number)
+            if ids and len(ids) == number and \
+                    all([i in self.store for i in ids[first - 1:last]]):
+                self.stats.count('skipped chunks')
+                continue
+            with self.export('bib', last, first) as f:
+                bibtex = bibtexparser.load(f)
+            for e in bibtex.entries:
+                references = e.get('cited-references', '')
+                self.store.add(self.cleanup_bibtex(e), references)
+            try:
+                self.driver.find_element_by_class_name(
+                    'quickoutput-cancel-action').click()
+            except:
+                pass
+
+    def from_store(self, entry, cited):
+        """ Return papers citing entry from the store, if all were found. """
+        if not len(self.store):
+            return None
+        ids = self.store.citing(paper_keys(entry))
+        if len(ids) != cited:
+            return None
+        return [self.store.get(i) for i in sorted(ids)]
+
+    def papers(self, workers=1):
+        """ Fetch data for all papers, using several browsers if workers>1. """
         # need to resort to get correct order!
-        select = Select(self.driver.find_element_by_id('selectSortBy_.top'))
-        select.select_by_index(1)
-        select = Select(self.driver.find_element_by_id('selectSortBy_.top'))
-        select.select_by_index(0)
+        for index in (1, 0):
+            element = self.driver.find_element_by_id('selectSortBy_.top')
+            Select(element).select_by_index(index)
+            self.wait(EC.staleness_of(element), 'sorting')
+        if workers > 1 or self.fast:
+            self.pool(self.links(), workers)
+            return
+        seen = {}
         while True:
-            sleep(1)
-            papers = self.driver.find_elements_by_xpath(
-                "//span[@id='records_chunks']//a[@class='smallV110']")
+            papers = self.records()
             for p in papers:
                 text = p.text
+                key = paper_key(text, p.get_attribute('href'), seen)
+                paper = self.resumed(key) or \
+                    self.refreshed(key, self.times_cited(p))
+                if paper:
+                    self.stats.count('reused papers')
+                    self.add_paper(*paper)
+                    self.stream(paper)
+                    continue
                 try:
-                    self.paper(p)
+                    self.paper(p, key)
                 except:
+                    self.stats.count('failed papers', title=text,
+                                     error=str(sys.exc_info()[1]))
                     self.driver.close()
                     self.driver.switch_to_window(self.main)
                     print 'Error: Could not fetch publication: ', text
                     self.results['errors'].append(text)
+
+            if not self.next_page(papers):
+                break
+
+    def links(self):
+        """ Collect titles and links of all papers from results pages. """
+        links = []
+        while True:
+            papers = self.records()
+            links.extend([(p.text, p.get_attribute('href'),
+                           self.times_cited(p)) for p in papers])
+            if not self.next_page(papers):
+                break
+        return links
+
+    def times_cited(self, link):
+        """ Read times cited count next to the link on results page. """
+        if not self.previous:
+            return None
+        try:
+            text = link.find_element_by_xpath(
+                "ancestor::div[contains(@class, 'search-results-item')]"
+                "//div[@class='search-results-data-cite']").text
+            return int(re.search(r'\d+', text.replace(',', '')).group())
+        except:
+            return None
+
+    def records(self):
+        """ Wait for links to papers on the current results page. """
+        return self.wait(EC.presence_of_all_elements_located((
+            By.XPATH, "//span[@id='records_chunks']//a[@class='smallV110']")),
+            'results page')
+
+    def next_page(self, papers):
+        """ Go to the next results page, return False on the last page. """
+        try:
+            self.driver.find_element_by_xpath(
+                "//a[@title='Next Page']").click()
+        except:
+            return False
+        if papers:
+            self.wait(EC.staleness_of(papers[0]), 'next page')
+        return True
+
+    def pool(self, links, workers):
+        """
+        Fetch papers from links using a pool of separate browsers.
+
+        Each worker has its own Chrome session and temporary download
+        directory. A single worker visits the links in the current tab
+        instead. Results are stored in the order of links.
+        """
+        from Queue import Queue, Empty
+        from threading import Thread
+        jobs = Queue()
+        seen = {}
+        keys = [paper_key(text, url, seen) for text, url, cited in links]
+        fetched = [self.resumed(key) or self.refreshed(key, cited)
+                   for key, (text, url, cited) in zip(keys, links)]
+        for n, link in enumerate(links):
+            if fetched[n] is None:
+                jobs.put((n, link))
+            else:
+                self.stats.count('reused papers')
+                self.stream(fetched[n])
+
+        def work(wos=None):
+            own = wos is None
+            if own:
+                wos = WebOfScience(None, self.timeout, self.base_url,
+                                   fast=self.fast)
+                wos.results['citing'] = self.results['citing']
+                wos.journals = self.journals
+                wos.store = self.store
+                wos.stats = self.stats
+            try:
+                while True:
                     try:
-                        os.unlink('saverecs.txt')
-                    except:
-                        pass
+                        n, (text, url, cited) = jobs.get_nowait()
+                    except Empty:
+                        break
                     try:
-                        os.unlink('saverecs.bib')
+                        fetched[n] = wos.visit(url)
+                        self.save(keys[n], fetched[n])
+                        self.stream(fetched[n])
                     except:
-                        pass
+                        self.stats.count('failed papers', title=text,
+                                         error=str(sys.exc_info()[1]))
+            finally:
+                if own:
+                    wos.close()
 
-            try:
-                self.driver.find_element_by_xpath(
-                    "//a[@title='Next Page']").click()
-            except:
-                break
+        if workers > 1:
+            threads = [Thread(target=work)
+                       for _ in range(min(workers, jobs.qsize()))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        else:
+            work(self)
+        for (text, url, cited), paper in zip(links, fetched):
+            if paper is None:
+                print 'Error: Could not fetch publication: ', text
+                self.results['errors'].append(text)
+            else:
+                self.add_paper(*paper)
 
     def cleanup_bibtex(self, entry):
         """ Make a good looking bibtex entry. """
@@ -175,98 +578,203 @@ class WebOfScience(object):
         entry = {k: entry[k] for k in good_keys}
         return entry
 
-    def paper(self, link):
-        """ Fetch data for a single paper. """
-        self.open_in_tab(link)
+    def paper(self, link, key):
+        """ Fetch data for a single paper, saved to checkpoint under key. """
+        text = link.text
+        with self.stats.timed('paper', title=text):
+            self.open_in_tab(link)
+            paper = self.fetch()
+        self.save(key, paper)
+        self.add_paper(*paper)
+        self.stream(paper)
+        self.driver.close()
+        self.driver.switch_to_window(self.main)
+
+    def resumed(self, key):
+        """ Return paper saved in checkpoint by an interrupted run, or None. """
+        if self.checkpoint is None:
+            return None
+        return self.checkpoint.papers.get(key)
+
+    def refresh(self, results):
+        """ Reuse papers from old results, unless their citations changed. """
+        self.previous = {}
+        seen = {}
+        # papers are found by WOS number, or by title and position in the list
+        for entry in results['papers']:
+            paper = (entry, self.citing(entry, results))
+            self.previous[entry['ID']] = paper
+            self.previous[paper_key(entry.get('title', ''), None, seen)] = \
+                paper
+
+    def refreshed(self, key, cited):
+        """ Return paper from old results if times cited is unchanged. """
+        paper = self.previous.get(key)
+        if paper is None or cited is None or str(cited) != paper[0]['cited']:
+            return None
+        entry, citing = paper
+        entry = dict(entry)
+        # citing papers without self-citations come from the new report
+        noself = [e for e in citing if e['ID'] in self.results['citing']]
+        entry['citednoself'] = str(len(noself))
+        return entry, citing
+
+    def save(self, key, paper):
+        """ Save fetched paper to checkpoint under key. """
+        if self.checkpoint is not None:
+            self.checkpoint.save(key, paper)
+
+    def stream(self, paper):
+        """ Pass fetched paper to the streaming formatter, if any. """
+        if self.formatter is not None:
+            self.formatter.put(*paper)
+
+    def visit(self, url):
+        """ Fetch data for a single paper, opening url in the current tab. """
+        with self.stats.timed('paper', url=url):
+            self.driver.get(url)
+            return self.fetch()
+
+    def add_paper(self, entry, citing):
+        """ Add paper entry and its citing papers to results. """
+        self.results['papers'].append(entry)
+        index = self.results['citingindex']
+        for e in citing:
+            index[e['ID']] = records.record(e)
+
+    def fetch(self):
+        """ Get bibtex entry and citing papers for the paper in current tab. """
+        import bibtexparser
         # get bibtex
-        select = Select(self.driver.find_element_by_name('saveToMenu'))
-        select.select_by_value("other")
-        select = Select(self.driver.find_element_by_name('fields_selection'))
-        select.select_by_index(2)
-        select = Select(self.driver.find_element_by_id('saveOptions'))
-        select.select_by_value("bibtex")
-        sleep(0.5)
-        self.driver.find_element_by_xpath(
-            "//span[@class='quickoutput-action']/input[@title='Send']").click()
-        sleep(3)
-        with open('savedrecs.bib') as f:
-            bibtex = f.read()
-        os.unlink('savedrecs.bib')
-        paper = bibtexparser.loads(bibtex)
-        entry = self.cleanup_bibtex(paper.entries[0])
-        self.driver.find_element_by_class_name('quickoutput-cancel-action') \
-            .click()
+        with self.stats.timed('bibtex export'):
+            select = Select(self.driver.find_element_by_name('saveToMenu'))
+            select.select_by_value("other")
+            select = Select(
+                self.driver.find_element_by_name('fields_selection'))
+            select.select_by_index(2)
+            select = Select(self.driver.find_element_by_id('saveOptions'))
+            select.select_by_value("bibtex")
+            with self.downloaded('bib', self.send()) as f:
+                paper = bibtexparser.load(f)
+            journal = paper.entries[0].get('issn')
+            entry = self.cleanup_bibtex(paper.entries[0])
+            journal = journal or entry.get('journal')
+            self.driver.find_element_by_class_name(
+                'quickoutput-cancel-action').click()
         # add impact factors
+        with self.stats.timed('impact factors'):
+            impact = self.journals.get(journal) if self.journals else None
+            if impact is None:
+                self.stats.count('journal cache misses')
+                impact = self.impact_factors()
+                if self.journals:
+                    self.journals.set(journal, impact)
+            else:
+                self.stats.count('journal cache hits')
+        entry.update(impact)
+        # add citing papers
+        citing = []
+        entry['cited'] = '0'
+        entry['citednoself'] = '0'
+        with self.stats.timed('citing export'):
+            try:
+                cited = int(self.driver.find_element_by_xpath(
+                    "//div[@class='block-text-content']//"
+                    "span[@class='TCcountFR']").text)
+                assert cited
+                papers = self.from_store(entry, cited)
+                if papers is None:
+                    self.stats.count('store misses')
+                    self.driver.find_element_by_xpath(
+                        "//div[@class='block-text-content']//a//"
+                        "span[@class='TCcountFR']/..").click()
+                    # get bibtex file with citing papers
+                    count = self.driver.find_element_by_id('hitCount.top').text
+                    with self.export('bib', count) as f:
+                        bibtex = bibtexparser.load(f)
+                    papers = []
+                    for e in bibtex.entries:
+                        references = e.get('cited-references', '')
+                        papers.append(self.store.add(self.cleanup_bibtex(e),
+                                                     references))
+                else:
+                    self.stats.count('store hits')
+                entry['cited'] = str(len(papers))
+                entry['citing'] = tuple([e['ID'] for e in papers])
+                noself = [e['ID'] for e in papers
+                          if e['ID'] in self.results['citing']]
+                entry['citednoself'] = str(len(noself))
+                citing = papers
+            except:
+                # no citations
+                pass
+        return entry, citing
+
+    def impact_factors(self):
+        """ Read journal impact factors from journal information. """
         self.driver.find_element_by_link_text('View Journal Information') \
             .click()
         IFs = self.driver.find_elements_by_xpath(
             "//table[@class='Impact_Factor_table']//td")
         IFtypes = self.driver.find_elements_by_xpath(
             "//table[@class='Impact_Factor_table']//th")
+        impact = {}
         for t, i in zip(IFtypes, IFs):
-            entry['impact' + t.text.replace(' ', '')] = i.text
-        # add citing papers
-        entry['cited'] = '0'
-        entry['citednoself'] = '0'
+            impact['impact' + t.text.replace(' ', '')] = i.text
         self.driver.find_element_by_xpath(
             "//a[@title='Hide journal information']").click()
-        sleep(1)
-        try:
-            assert int(self.driver.find_element_by_xpath(
-                "//div[@class='block-text-content']//"
-                "span[@class='TCcountFR']").text)
-            self.driver.find_element_by_xpath(
-                "//div[@class='block-text-content']//a//"
-                "span[@class='TCcountFR']/..").click()
-            # get bibtex file with citing papers
-            citing = self.driver.find_element_by_id('hitCount.top').text
-            select = Select(self.driver.find_element_by_name('saveToMenu'))
-            select.select_by_value("other")
-            self.driver.find_element_by_name('value(record_select_type)') \
-                .click()
-            self.driver.find_element_by_name('markFrom').send_keys('1')
-            self.driver.find_element_by_name('markTo').send_keys(citing)
-            select = Select(
-                self.driver.find_element_by_name('fields_selection'))
-            select.select_by_index(2)
-            select = Select(self.driver.find_element_by_id('saveOptions'))
-            select.select_by_value("bibtex")
-            sleep(0.5)
-            self.driver.find_element_by_xpath(
-                "//span[@class='quickoutput-action']"
-                "/input[@title='Send']").click()
-            sleep(3)
-            with open('savedrecs.bib') as f:
-                bibtex = f.read()
-            os.unlink('savedrecs.bib')
-            bibtex = bibtexparser.loads(bibtex)
-            bibtex.entries = [self.cleanup_bibtex(e) for e in bibtex.entries]
-            entry['cited'] = str(len(bibtex.entries))
-            entry['citing'] = ','.join([e['ID'] for e in bibtex.entries])
-            noself = [e['ID'] for e in bibtex.entries
-                      if e['ID'] in self.results['citing']]
-            entry['citednoself'] = str(len(noself))
-            self.results['citingbib'].entries.extend(bibtex.entries)
-        except:
-            # no citations
-            pass
-        self.results['papers'].entries.append(entry)
-        self.driver.close()
-        self.driver.switch_to_window(self.main)
+        self.wait(EC.invisibility_of_element_located((
+            By.XPATH, "//table[@class='Impact_Factor_table']")),
+            'hide journal information')
+        return impact
+
+    def self_citations(self, authors=None):
+        """
+        Recompute citations without self-citations from author lists.
+
+        authors defaults to the names searched by the query.
+        """
+        with self.stats.timed('self-citations'):
+            own = selfcite.update(self.results, authors)
+        self.stats.count('self-citing papers', len(own))
 
     def finish(self):
         """ Cleanup data and close browser driver. """
-        unique = {e['ID']: e for e in self.results['citingbib'].entries}
-        self.results['citingbib'].entries = unique.values()
-        self.driver.quit()
+        self.results['stats'] = self.stats.summary()
+        self.close()
+
+    def close(self):
+        """ Close browser driver, and remove temporary download directory. """
+        if self._driver is not None:
+            self._driver.quit()
+            self._driver = None
+        if self.own_path:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def citing(self, paper, results=None):
+        """ Return entries citing the paper, using the citing papers index. """
+        results = self.results if results is None else results
+        ids = paper.get('citing', ())
+        if isinstance(ids, basestring):
+            # comma separated string from old data files
+            ids = [i for i in ids.split(',') if i]
+        index = results['citingindex']
+        return [index[i] for i in ids if i in index]
 
     def latex(self, name='results', **options):
-        """ Generate file with results. """
-        from bibtex import BibTex
-        bib = BibTex(authorStyle='textbf', titleStyle='textit')
-        bib2 = BibTex(genBibitems=True, IncludeDOIURL='Exclude')
-        parsed = bibtexparser.loads("")
-        f = open(name + '.tex', 'w')
+        """
+        Generate file with results.
+
+        Papers already formatted by the streaming formatter are not formatted
+        again, so the file is mostly a concatenation of their fragments, with
+        citation counts as they are now, e.g. after self_citations.
+        """
+        from StringIO import StringIO
+        engine = options.get('engine', 'bibtex')
+        full = 'full' not in options or options['full']
+        formatter = self.formatter or Formatter(engine, full)
+        fragments = formatter.close()
+        f = StringIO()
         # totals
         print >>f, r"""
 \documentclass[12pt]{article}
@@ -294,29 +802,24 @@ linkcolor=blue]{hyperref}
                         self.results['citations'],
                         self.results['citationsnoself'],
                         self.results['h-index'])
+        # format remaining papers and all citing papers in one BibTex run each
+        rest = [p for p in self.results['papers'] if p['ID'] not in fragments]
+        if rest:
+            entries = self.results['citingindex'].values()
+            if formatter.streamed:
+                # only papers missed by the thread, relabelled below anyway
+                entries = {e['ID']: e for p in rest
+                           for e in self.citing(p)}.values()
+            with self.stats.timed('bibtex'):
+                fragments.update(formatter.format(rest, self.citing, entries))
+        if formatter.streamed and full:
+            formatter.relabel(self.results['citingindex'].values())
+        self.stats.count('bibtex subprocesses', formatter.subprocesses())
         # each paper
-        if not self.results['papers'].entries:
+        if not self.results['papers']:
             print >>f, r'\item Fetching failed for all papers.'
-        for paper in self.results['papers'].entries:
-            parsed.entries = [paper]
-            data = bib.run(bibtexparser.dumps(parsed))
-            print >>f, r'\item ' + data
-            print >>f, '\n Journal impact factors: ',
-            for k, v in paper.items():
-                if 'impact' in k:
-                    print >>f, k.replace('impact', '') + ': ' + str(v) + '.',
-            print >>f, ''
-            print >>f, '\n Cited by {} papers. Excluding self-citations: {}\n' \
-                .format(paper['cited'], paper['citednoself'])
-            if int(paper['cited']) and \
-                    ('full' not in options or options['full']):
-                parsed.entries = [e for e in self.results['citingbib'].entries
-                                  if e['ID'] in paper['citing']]
-                data = bib2.run(bibtexparser.dumps(parsed))
-                print >>f, r'\vspace{-0.5cm}\begin{thebibliography}{99}'
-                print >>f, r'\setlength{\itemsep}{0pt}'
-                print >>f, data
-                print >>f, r'\end{thebibliography}'
+        for paper in self.results['papers']:
+            f.write(formatter.text(paper, fragments[paper['ID']]))
         # any errors
         if self.results['errors']:
             print >>f, r'\end{enumerate}'
@@ -330,32 +833,545 @@ linkcolor=blue]{hyperref}
 
 \end{document}
 """
+        tex = f.getvalue()
         f.close()
-        os.system('pdflatex {}.tex'.format(name))
-        os.system('pdflatex {}.tex'.format(name))
-        os.unlink(name + '.log')
-        os.unlink(name + '.aux')
+        if isinstance(tex, unicode):
+            tex = tex.encode('utf-8')
+        self.build(name, tex, options)
+        self.results['stats'] = self.stats.summary()
+
+    def build(self, name, tex, options):
+        """
+        Compile tex into name.pdf, unless the PDF was built from it already.
+
+        PDF files are identified by a hash of tex and options, kept in
+        name.hash, which is only written after pdflatex succeeded. The second
+        pdflatex pass only runs if the first one asks for it to resolve
+        references.
+        """
+        key = hashlib.sha1(tex + repr(sorted(options.items()))).hexdigest()
+        try:
+            with open(name + '.hash') as f:
+                built = f.read().strip() == key
+        except:
+            built = False
+        if built and os.path.exists(name + '.pdf'):
+            self.stats.count('pdf builds skipped')
+            return
+        try:
+            with open(name + '.tex') as f:
+                changed = f.read() != tex
+        except:
+            changed = True
+        if changed:
+            with open(name + '.tex', 'w') as f:
+                f.write(tex)
+        try:
+            os.unlink(name + '.hash')
+        except:
+            pass
+        # mtime may be truncated to seconds
+        start = int(time())
+        runs = 0
+        failed = False
+        with self.stats.timed('pdflatex'):
+            while runs < 2 and (not runs or self.rerun(name)):
+                failed = os.system('pdflatex {}.tex'.format(name)) != 0
+                runs += 1
+                if failed:
+                    break
+        self.stats.count('pdflatex runs', runs)
+        for ext in ('log', 'aux'):
+            try:
+                os.unlink(name + '.' + ext)
+            except:
+                pass
+        if failed:
+            self.stats.count('pdflatex failures')
+        elif (os.path.exists(name + '.pdf') and
+              os.path.getmtime(name + '.pdf') >= start):
+            with open(name + '.hash', 'w') as f:
+                print >>f, key
+
+    def rerun(self, name):
+        """
+        Check if pdflatex asked for another pass.
+
+        Changed labels of bibitems are ignored: the report never refers to
+        them, and LaTeX always warns about them when there is no old .aux.
+        """
+        try:
+            with open(name + '.log') as f:
+                log = f.read()
+        except:
+            return False
+        return bool(re.search(r'Rerun to get|undefined references', log))
+
+    def write(self, name='results', formats=('json',), **options):
+        """ Generate files with results in given formats, without LaTeX. """
+        from writers import WRITERS
+        full = 'full' not in options or options['full']
+        for ext in formats:
+            with self.stats.timed('write ' + ext):
+                WRITERS[ext](self.results, self.citing, full).write(name)
+        self.results['stats'] = self.stats.summary()
+
+
+class Checkpoint(object):
+
+    """ Append-only log of fetched papers, for resuming interrupted runs. """
+
+    def __init__(self, filename):
+        """ Load papers saved in filename, and open it for appending. """
+        from threading import Lock
+        self.filename = filename
+        self.lock = Lock()
+        self.papers = {}
+        good = 0
+        try:
+            with open(filename, 'rb') as f:
+                while True:
+                    key, paper = pickle.load(f)
+                    self.papers[key] = paper
+                    good = f.tell()
+        except:
+            # end of file, or a record cut short by a crash
+            pass
+        self.file = open(filename, 'ab')
+        self.file.truncate(good)
+
+    def save(self, key, paper):
+        """ Append paper to the log. """
+        with self.lock:
+            pickle.dump((key, paper), self.file, protocol=-1)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def remove(self):
+        """ Close and delete the log, once all data is safely stored. """
+        self.file.close()
+        os.unlink(self.filename)
+
+
+class Store(object):
+
+    """ Citing papers shared between searches, indexed by their references. """
+
+    def __init__(self):
+        """ Start with an empty store. """
+        from threading import Lock
+        self.lock = Lock()
+        self.entries = {}
+        self.cites = {}
+
+    def __len__(self):
+        """ Number of stored papers. """
+        return len(self.entries)
 
+    def __contains__(self, ID):
+        """ Check if paper with given WOS id is stored. """
+        return ID in self.entries
 
-def search(query, name='results', new=False, **options):
-    """ Execute search. """
-    wos = WebOfScience()
-    import pickle
+    def add(self, entry, references):
+        """ Store cleaned up entry, indexing its cited references. """
+        entry = records.record(entry)
+        with self.lock:
+            self.entries[entry['ID']] = entry
+            for key in reference_keys(references):
+                self.cites.setdefault(key, set()).add(entry['ID'])
+        return entry
+
+    def get(self, ID):
+        """ Stored paper with given WOS id. """
+        return self.entries[ID]
+
+    def citing(self, keys):
+        """ WOS ids of stored papers citing a paper with any of the keys. """
+        ids = set()
+        with self.lock:
+            for key in keys:
+                ids.update(self.cites.get(key, ()))
+        return ids
+
+
+class Stats(object):
+
+    """ Wall times of stages and counters of a run, with optional trace. """
+
+    def __init__(self, trace=None):
+        """ Start collecting, appending each record to trace file if given. """
+        from threading import Lock
+        self.lock = Lock()
+        self.start = time()
+        self.stages = {}
+        self.counters = {}
+        self.trace = open(trace, 'a') if trace else None
+
+    def add(self, stage, seconds, **data):
+        """ Record a single run of stage, which took given seconds. """
+        with self.lock:
+            count, total = self.stages.get(stage, (0, 0.0))
+            self.stages[stage] = (count + 1, total + seconds)
+            self.write(dict(data, stage=stage, seconds=seconds))
+
+    def count(self, counter, n=1, **data):
+        """ Increase counter by n. """
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+            self.write(dict(data, counter=counter, n=n))
+
+    @contextmanager
+    def timed(self, stage, **data):
+        """ Record the time of the with block as a run of stage. """
+        start = time()
+        try:
+            yield
+        finally:
+            self.add(stage, time() - start, **data)
+
+    def write(self, record):
+        """ Append record to the trace file. """
+        if self.trace is not None:
+            record['time'] = time() - self.start
+            print >>self.trace, json.dumps(record, sort_keys=True)
+            self.trace.flush()
+
+    def summary(self):
+        """ Totals as plain dictionaries, for storing with results. """
+        with self.lock:
+            return {
+                'seconds': time() - self.start,
+                'stages': {k: {'count': c, 'seconds': s}
+                           for k, (c, s) in self.stages.items()},
+                'counters': dict(self.counters),
+            }
+
+    def close(self):
+        """ Close the trace file. """
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+
+class Formatter(object):
+
+    """
+    Format papers into LaTeX fragments of the list of papers.
+
+    Once started, papers put in the queue are formatted by a thread while
+    other papers are still being fetched.
+    """
+
+    def __init__(self, engine='bibtex', full=True, stats=None):
+        """ Format with engine, listing citing papers if full. """
+        from bibtex import BibTex
+        from Queue import Queue
+        self.bib = BibTex(engine, authorStyle='textbf', titleStyle='textit')
+        self.bib2 = BibTex(engine, genBibitems=True, IncludeDOIURL='Exclude')
+        self.full = full
+        self.stats = stats or Stats()
+        self.queue = Queue()
+        self.thread = None
+        self.fragments = {}
+        # IDs of papers formatted by the thread
+        self.streamed = set()
+        # bibitem keys of citing papers by ID, if set by relabel
+        self.labels = None
+
+    def subprocesses(self):
+        """ Number of latex and bibtex processes run so far. """
+        return self.bib.subprocesses + self.bib2.subprocesses
+
+    def format(self, papers, citing, entries):
+        """
+        Return fragments of papers by ID.
+
+        citing(paper) returns entries citing the paper, all of them among
+        entries. Entries are formatted in one BibTex run, and keep its order.
+        """
+        texts = self.bib.runBatch([{k: v for k, v in p.items()
+                                    if k != 'citing'} for p in papers])
+        items = {}
+        order = {}
+        if self.full and entries:
+            items = self.bib2.runBatch(entries)
+            order = {k: n for n, k in enumerate(items)}
+        fragments = {}
+        for paper in papers:
+            listed = None
+            if int(paper['cited']) and self.full:
+                ids = sorted([e['ID'] for e in citing(paper)
+                              if e['ID'] in order], key=order.get)
+                listed = [(i, items[i]) for i in ids]
+            fragments[paper['ID']] = self.fragment(
+                paper, texts.get(paper['ID'], ''), listed)
+        return fragments
+
+    def fragment(self, paper, text, items):
+        """
+        Item of paper in the list of papers, with citing items if any.
+
+        Citation counts and the list of citing items are put in by text, as
+        self-citations and bibitem keys may change after formatting.
+        """
+        from StringIO import StringIO
+        f = StringIO()
+        print >>f, r'\item ' + text
+        print >>f, '\n Journal impact factors: ',
+        for k, v in paper.items():
+            if 'impact' in k:
+                print >>f, k.replace('impact', '') + ': ' + str(v) + '.',
+        print >>f, ''
+        return f.getvalue(), items
+
+    def text(self, paper, fragment):
+        """ LaTeX of a fragment, with current citation counts of paper. """
+        from StringIO import StringIO
+        head, items = fragment
+        f = StringIO()
+        f.write(head)
+        print >>f, '\n Cited by {} papers. Excluding self-citations: {}\n' \
+            .format(paper['cited'], paper['citednoself'])
+        if items is not None:
+            print >>f, r'\vspace{-0.5cm}\begin{thebibliography}{99}'
+            print >>f, r'\setlength{\itemsep}{0pt}'
+            print >>f, '\n\n'.join([self.key(i, item) for i, item in items])
+            print >>f, r'\end{thebibliography}'
+        return f.getvalue()
+
+    def relabel(self, entries):
+        """
+        Use bibitem keys made for all entries in items of streamed papers.
+
+        Keys are made unique with extra letters over all citing papers in
+        batch mode, but only over citing papers of one paper when streaming.
+        """
+        self.labels = self.bib2.style.keys(entries)
+
+    def key(self, ID, item):
+        """ Item with its bibitem key replaced by the key from relabel. """
+        if self.labels is None or ID not in self.labels:
+            return item
+        start = item.find('\\bibitem')
+        if start < 0:
+            return item
+        start += len('\\bibitem')
+        if item[start:start + 1] == '[':
+            start = item.index(']', start) + 1
+        if item[start:start + 1] != '{':
+            return item
+        end = _closing(item, start)
+        return item[:start] + '{' + self.labels[ID] + '}' + item[end + 1:]
+
+    def start(self):
+        """ Start formatting papers put in the queue. """
+        from threading import Thread
+        self.thread = Thread(target=self.work)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, entry, citing):
+        """ Queue paper entry with its citing papers for formatting. """
+        self.queue.put((entry, list(citing)))
+
+    def work(self):
+        """ Format queued papers until None is queued. """
+        while True:
+            paper = self.queue.get()
+            if paper is None:
+                break
+            entry, citing = paper
+            try:
+                with self.stats.timed('stream formatting'):
+                    self.fragments.update(self.format(
+                        [entry], lambda paper: citing, citing))
+                self.streamed.add(entry['ID'])
+                self.stats.count('streamed papers')
+            except:
+                # formatted again in latex
+                self.stats.count('failed formatting', title=entry.get('ID'),
+                                 error=str(sys.exc_info()[1]))
+
+    def close(self):
+        """ Wait for queued papers, return fragments formatted so far. """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        return self.fragments
+
+
+class Journals(object):
+
+    """ Impact factors of journals, cached on disk between runs. """
+
+    def __init__(self, filename='journals.dat', days=30):
+        """ Load cache from filename, with entries valid for given days. """
+        from threading import Lock
+        self.filename = filename
+        self.age = days * 24 * 3600
+        self.lock = Lock()
+        try:
+            with open(filename, 'rb') as f:
+                self.impact = pickle.load(f)
+        except:
+            self.impact = {}
+
+    def get(self, journal):
+        """ Return impact factors of journal, or None if unknown or stale. """
+        if not journal:
+            return None
+        with self.lock:
+            saved, impact = self.impact.get(journal, (0, None))
+        if time() - saved > self.age:
+            return None
+        return dict(impact)
+
+    def set(self, journal, impact):
+        """ Remember impact factors of journal. """
+        if journal:
+            with self.lock:
+                self.impact[journal] = (time(), dict(impact))
+
+    def save(self):
+        """ Write cache to disk. """
+        with self.lock:
+            with open(self.filename, 'wb') as f:
+                pickle.dump(self.impact, f, protocol=-1)
+
+
+def search(query, name='results', new=False, refresh=False, workers=1,
+           timeout=30, journals='journals.dat', days=30, bulk=False,
+           base_url=None, trace=None, fast=False, store=None,
+           formats=('pdf',), stream=False, selfcite=False, **options):
+    """
+    Execute search, fetching papers with given number of browsers.
+
+    With refresh, old data is reused for papers with unchanged citation counts.
+    Journal impact factors are cached in journals file for given days.
+    With bulk, citing papers are exported for all papers at once.
+    Pages are fetched from base_url, e.g. a local stand-in server.
+    Timings and counters end up in results['stats'], and in trace file.
+    With fast, Chrome runs headless and loads only what is needed.
+    Citing papers are taken from, and added to, store if given.
+    Reports are written in formats: 'pdf' through LaTeX, 'json', 'html', 'md'.
+    With stream, papers are formatted for LaTeX while others are fetched.
+    With selfcite, self-citations are papers by the authors searched by the
+    query, or by selfcite if it is a list of names, found in saved author lists
+    instead of the citation report.
+    """
+    wos = WebOfScience(timeout=timeout, base_url=base_url, trace=trace,
+                       fast=fast)
+    if store is not None:
+        wos.store = store
+    if new:
+        # papers of an interrupted run are not reused either
+        for ext in ('dat', 'part'):
+            try:
+                os.unlink(name + '.' + ext)
+            except:
+                pass
     try:
-        if new:
-            os.unlink(name + '.dat')
-        with open(name + '.dat', 'r') as f:
-            wos.results = pickle.load(f)
-        wos.driver.quit()
+        with wos.stats.timed('load'):
+            results = records.load(name + '.dat')
     except:
-        wos.search(query)
-        wos.report()
-        wos.papers()
+        results = None
+    authors = None if selfcite is True else selfcite
+    if results is not None and not refresh:
+        wos.results = results
+        wos.close()
+        if selfcite:
+            wos.self_citations(authors)
+    else:
+        if results is not None:
+            wos.refresh(results)
+        # resume from papers saved by an interrupted run
+        wos.checkpoint = Checkpoint(name + '.part')
+        wos.journals = Journals(journals, days)
+        if stream and 'pdf' in formats:
+            wos.formatter = Formatter(options.get('engine', 'bibtex'),
+                                      options.get('full', True), wos.stats)
+            wos.formatter.start()
+        for stage, args in (('search', [query]),
+                            ('report', [bulk, not selfcite]),
+                            ('papers', [workers])):
+            with wos.stats.timed(stage):
+                getattr(wos, stage)(*args)
+        if selfcite:
+            wos.self_citations(authors)
         wos.finish()
-        with open(name + '.dat', 'w') as f:
-            pickle.dump(wos.results, f, protocol=-1)
-    wos.latex(name, **options)
+        wos.journals.save()
+        records.save(wos.results, name + '.dat')
+        wos.checkpoint.remove()
+    if 'pdf' in formats:
+        wos.latex(name, **options)
+    others = [ext for ext in formats if ext != 'pdf']
+    if others:
+        wos.write(name, others, **options)
+    wos.stats.close()
+
+
+def batch(searches, store=None, **options):
+    """
+    Execute several searches, sharing citing papers between them.
+
+    searches is a list of (query, name, options) tuples, where options of each
+    search override common options, including the store. Each search still
+    produces its own files. Returns the store of citing papers, which can be
+    passed to the next batch.
+    """
+    store = Store() if store is None else store
+    for query, name, own in searches:
+        kwargs = dict(options, store=store)
+        kwargs.update(own)
+        search(query, name, **kwargs)
+    return store
 
 
 if __name__ == '__main__':
-    search('AU=siudeja,b*', 'SiudejaB', new=False, full=True)
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Fetch Web of Science citation profile and write a report.',
+        epilog='Example: python wos.py "AU=siudeja,b*" SiudejaB')
+    parser.add_argument('query', help='Web of Science query, e.g. AU=Last,F*')
+    parser.add_argument('name', nargs='?', default='results',
+                        help='name of generated files')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--new', action='store_true',
+                       help='fetch again, ignoring saved results')
+    group.add_argument('--refresh', action='store_true',
+                       help='fetch again only papers with changed citations')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--full', dest='full', action='store_true',
+                       default=True, help='list citing papers (default)')
+    group.add_argument('--counts', dest='full', action='store_false',
+                       help='only count citing papers')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of browsers fetching papers')
+    parser.add_argument('--format', dest='formats', nargs='+',
+                        default=['pdf'], choices=['pdf', 'json', 'html', 'md'],
+                        help='report formats')
+    parser.add_argument('--engine', default='bibtex',
+                        choices=['bibtex', 'python'],
+                        help='format entries with BibTeX, or in Python')
+    parser.add_argument('--bulk', action='store_true',
+                        help='export citing papers of all papers at once')
+    parser.add_argument('--fast', action='store_true',
+                        help='headless Chrome loading only what is needed')
+    parser.add_argument('--stream', action='store_true',
+                        help='format papers while others are fetched')
+    parser.add_argument('--selfcite', nargs='*', metavar='NAME',
+                        help='count self-citations from author lists, of the '
+                        'searched authors or of given names')
+    parser.add_argument('--timeout', type=float, default=30,
+                        help='seconds to wait for pages and downloads')
+    parser.add_argument('--base-url', help='address of Web of Science')
+    parser.add_argument('--trace', help='JSON-lines file of timings')
+    args = parser.parse_args()
+    # names given, or True for the searched authors
+    authors = args.selfcite or args.selfcite is not None
+    search(args.query, args.name, new=args.new, refresh=args.refresh,
+           workers=args.workers, timeout=args.timeout, bulk=args.bulk,
+           base_url=args.base_url, trace=args.trace, fast=args.fast,
+           formats=args.formats, stream=args.stream, selfcite=authors,
+           full=args.full, engine=args.engine)
@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the parts of Web of Science used by wos.py.
+
+Serves a synthetic citation profile through the same pages the scraper walks:
+home page, advanced search, search history, results list with pagination and
+sorting, citation report, full records with journal information, lists of
+citing papers, and an export endpoint returning savedrecs.bib or savedrecs.txt.
+
+Run it with the number of papers and the latency of every request, e.g.
+    python wosserver.py --papers 200 --latency 0.05 --port 8000
+and point the scraper at it:
+    search('AU=doe,j*', 'local', base_url='http://127.0.0.1:8000')
+"""
+
+import BaseHTTPServer
+import SocketServer
+import random
+import threading
+import time
+import urllib
+from urlparse import urlparse, parse_qs
+from cgi import escape
+
+
+# number of records on a single results page
+PAGE = 10
+
+_JOURNALS = [
+    ('J. Funct. Anal.', 'JOURNAL OF FUNCTIONAL ANALYSIS', '0022-1236'),
+    ('Trans. Am. Math. Soc.', 'TRANSACTIONS OF THE AMERICAN MATHEMATICAL '
+     'SOCIETY', '0002-9947'),
+    ('Proc. Amer. Math. Soc.', 'PROCEEDINGS OF THE AMERICAN MATHEMATICAL '
+     'SOCIETY', '0002-9939'),
+    ('J. Math. Anal. Appl.', 'JOURNAL OF MATHEMATICAL ANALYSIS AND '
+     'APPLICATIONS', '0022-247X'),
+    ('Potential Anal.', 'POTENTIAL ANALYSIS', '0926-2601'),
+    ('Studia Math.', 'STUDIA MATHEMATICA', '0039-3223'),
+    ('Ann. Probab.', 'ANNALS OF PROBABILITY', '0091-1798'),
+    ('Israel J. Math.', 'ISRAEL JOURNAL OF MATHEMATICS', '0021-2172'),
+]
+
+_WORDS = ('spectral', 'eigenvalue', 'inequality', 'domain', 'Laplacian',
+          'stable', 'process', 'estimate', 'bound', 'gap', 'trace', 'heat',
+          'kernel', 'triangle', 'polygon', 'Neumann', 'Dirichlet', 'fractional',
+          'isoperimetric', 'conjecture', 'sharp', 'asymptotic', 'operator')
+
+_NAMES = ('Smith', 'Banuelos', 'Kulczycki', 'Laugesen', 'Kwasnicki', 'Chen',
+          'Nguyen', 'Garcia', 'Mueller', 'Rossi', 'Tanaka', 'Kowalski')
+
+
+class Profile(object):
+
+    """ Synthetic citation profile of a single author. """
+
+    def __init__(self, papers=50, seed=0, alpha=1.2, maximum=2000,
+                 selfrate=0.1, author='Doe, John'):
+        """
+        Generate given number of papers with heavy-tailed citation counts.
+
+        Counts follow a Pareto distribution with given alpha, capped at
+        maximum. A selfrate fraction of citing papers are self-citations.
+        """
+        rng = random.Random(seed)
+        self.author = author
+        self.journals = {}
+        for iso, name, issn in _JOURNALS:
+            self.journals[issn] = [('2015', '%.3f' % rng.uniform(0.3, 2.5)),
+                                   ('5 Year', '%.3f' % rng.uniform(0.3, 2.5))]
+        counts = [min(int(rng.paretovariate(alpha)) - 1, maximum)
+                  for _ in range(papers)]
+        # citing papers are shared between papers
+        pool = max([0] + counts)
+        pool = max(pool, int(sum(counts) * 0.6))
+        self.citing = [self.record(rng, 'WOS:%015d' % (500000000 + n),
+                                   rng.random() < selfrate)
+                       for n in range(pool)]
+        self.papers = []
+        for n, count in enumerate(counts):
+            paper = self.record(rng, 'WOS:%015d' % (100000000 + n), True)
+            paper['title'] = 'Paper {} on {} {} {}'.format(
+                n + 1, *rng.sample(_WORDS, 3))
+            paper['citing'] = sorted(rng.sample(xrange(pool), count))
+            self.papers.append(paper)
+            for c in paper['citing']:
+                self.citing[c]['references'].append(paper)
+        self.index = {r['uid']: r for r in self.papers + self.citing}
+
+    def record(self, rng, uid, own):
+        """ Random record with given WOS id, written by author if own. """
+        iso, name, issn = rng.choice(_JOURNALS)
+        authors = ['{}, {}.'.format(rng.choice(_NAMES),
+                                    chr(65 + rng.randrange(26)))
+                   for _ in range(rng.randint(0 if own else 1, 3))]
+        if own:
+            authors.insert(rng.randint(0, len(authors)), self.author)
+        page = rng.randint(1, 900)
+        return {
+            'uid': uid,
+            'authors': authors,
+            'title': ' '.join(rng.sample(_WORDS, 5)).capitalize(),
+            'journal': name,
+            'iso': iso,
+            'issn': issn,
+            'year': str(rng.randint(1995, 2016)),
+            'volume': str(rng.randint(1, 400)),
+            'pages': '{}-{}'.format(page, page + rng.randint(5, 40)),
+            'doi': '10.5555/{}'.format(uid[4:].lstrip('0')),
+            'self': own,
+            'references': [],
+        }
+
+    def cited(self, paper):
+        """ Citing papers of paper, newest first. """
+        return sorted([self.citing[c] for c in paper['citing']],
+                      key=lambda r: (r['year'], r['uid']), reverse=True)
+
+    def noself(self, own=False):
+        """ Citing papers of all papers, without self-citations unless own. """
+        ids = set()
+        for paper in self.papers:
+            ids.update([c for c in paper['citing']
+                        if own or not self.citing[c]['self']])
+        return [self.citing[c] for c in sorted(ids)]
+
+    def totals(self):
+        """ Numbers shown in the citation report. """
+        counts = [len(p['citing']) for p in self.papers]
+        noself = sum([len([c for c in p['citing']
+                           if not self.citing[c]['self']])
+                      for p in self.papers])
+        h = len([n for n, c in enumerate(sorted(counts, reverse=True))
+                 if c > n])
+        return len(counts), sum(counts), noself, h
+
+    def sorted(self, sort):
+        """ Papers in the order of results list. """
+        if sort == 'TC.D':
+            key = lambda p: (len(p['citing']), p['uid'])
+        else:
+            key = lambda p: (p['year'], p['uid'])
+        return sorted(self.papers, key=key, reverse=True)
+
+    def find(self, uid):
+        """ Paper or citing paper with given WOS id. """
+        return self.index[uid]
+
+    def bibtex(self, record, references=False):
+        """ Bibtex entry of a record, as exported by Web of Science. """
+        fields = [
+            ('Author', ' and '.join(record['authors'])),
+            ('Title', record['title']),
+            ('Journal', record['journal']),
+            ('Year', record['year']),
+            ('Volume', record['volume']),
+            ('Pages', record['pages']),
+            ('DOI', record['doi']),
+            ('ISSN', record['issn']),
+            ('Journal-ISO', record['iso']),
+        ]
+        if references and record['references']:
+            fields.append(('Cited-References', '\n   '.join([
+                '{}, {}, {}, V{}, P{}, DOI {}'.format(
+                    r['authors'][0].split(',')[0].upper(), r['year'],
+                    r['iso'].upper().replace('.', ''), r['volume'],
+                    r['pages'].split('-')[0], r['doi'])
+                for r in record['references']])))
+        fields.append(('Unique-ID', record['uid']))
+        return '@article{{ {},\n{}\n}}\n'.format(record['uid'], ',\n'.join(
+            ['{} = {{{{{}}}}}'.format(k, v) if k == 'Title'
+             else '{} = {{{}}}'.format(k, v) for k, v in fields]))
+
+    def tagged(self, record):
+        """ Field tagged record, as exported by Web of Science. """
+        lines = ['PT J']
+        lines.extend([('AU ' if n == 0 else '   ') + a
+                      for n, a in enumerate(record['authors'])])
+        lines.extend(['TI ' + record['title'], 'SO ' + record['journal'],
+                      'PY ' + record['year'], 'VL ' + record['volume'],
+                      'DI ' + record['doi'], 'UT ' + record['uid'], 'ER', ''])
+        return '\n'.join(lines)
+
+
+_EXPORT = """
+<form action="/export" method="get">
+<input type="hidden" name="list" value="{0}">
+<select name="saveToMenu">
+<option value="endnote">Save to EndNote online</option>
+<option value="other">Save to Other File Formats</option>
+</select>
+<input type="radio" name="value(record_select_type)" value="range">
+Records <input type="text" name="markFrom" value="1">
+to <input type="text" name="markTo" value="">
+<select name="fields_selection">
+<option value="author">Author, Title, Source</option>
+<option value="abstract">Author, Title, Source, Abstract</option>
+<option value="full">Full Record and Cited References</option>
+</select>
+<select id="saveOptions" name="saveOptions">
+<option value="other">Other Reference Software</option>
+<option value="bibtex">BibTeX</option>
+<option value="fieldtagged">Plain Text</option>
+</select>
+<span class="quickoutput-action"><input type="submit" title="Send" value="Send"></span>
+<a class="quickoutput-cancel-action" href="#">Cancel</a>
+</form>
+"""
+
+_JOURNAL = """
+<a href="#" onclick="document.getElementById('journal').style.display='block';
+return false;">View Journal Information</a>
+<div id="journal" style="display:none">
+<table class="Impact_Factor_table"><tr>{0}</tr><tr>{1}</tr></table>
+<a href="#" title="Hide journal information"
+onclick="document.getElementById('journal').style.display='none';
+return false;">Hide</a>
+</div>
+"""
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """ Serve pages of the profile given by the server. """
+
+    def do_GET(self):
+        """ Dispatch request to the page method. """
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        page = getattr(self, 'page_' + (url.path.strip('/') or 'home'), None)
+        if page is None:
+            return self.send_error(404)
+        try:
+            page(self.server.profile, query)
+        except (KeyError, ValueError, IndexError):
+            self.send_error(400)
+
+    def log_message(self, *args):
+        """ Log requests only when verbose. """
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, *args)
+
+    def respond(self, body, kind='text/html', filename=None):
+        """ Send the page, or a file download if filename is given. """
+        self.send_response(200)
+        self.send_header('Content-Type', kind + '; charset=utf-8')
+        if filename:
+            self.send_header('Content-Disposition',
+                             'attachment; filename=' + filename)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def html(self, body):
+        """ Send body wrapped in a page. """
+        self.respond('<html><head><title>Web of Science</title></head>'
+                     '<body>{}</body></html>'.format(body))
+
+    def page_home(self, profile, query):
+        """ Home page with the search menu. """
+        self.html('<span class="icon-dd-active-block-search">Search</span>'
+                  '<ul><li><a title="Advanced Search" href="/advanced">'
+                  'Advanced Search</a></li></ul>')
+
+    def page_advanced(self, profile, query):
+        """ Advanced search form. """
+        self.html('<form action="/history" method="get">'
+                  '<textarea id="value(input1)" name="query"></textarea>'
+                  '<input type="submit" id="searchButton" value="Search">'
+                  '</form>')
+
+    def page_history(self, profile, query):
+        """ Search history with a link to the results. """
+        self.html('<div id="set_1_div"><a href="/results?{}">{:,}</a></div>'
+                  .format(urllib.urlencode({'query': query.get('query', '')}),
+                          len(profile.papers)))
+
+    def page_results(self, profile, query):
+        """ Page of the results list. """
+        sort = query.get('sort', 'PY.D')
+        page = int(query.get('page', 1))
+        papers = profile.sorted(sort)[(page - 1) * PAGE:page * PAGE]
+        options = ''.join(['<option value="{}"{}>{}</option>'.format(
+            v, ' selected' if v == sort else '', t) for v, t in (
+                ('PY.D', 'Publication Date -- newest to oldest'),
+                ('TC.D', 'Times Cited -- highest to lowest'))])
+        body = ['<a alt="View Citation Report" href="/report">'
+                'Create Citation Report</a>',
+                '<select id="selectSortBy_.top" onchange="location.href='
+                '\'/results?sort=\' + this.value">{}</select>'.format(options),
+                '<span id="records_chunks">']
+        for paper in papers:
+            body.append(
+                '<div class="search-results-item">'
+                '<a class="smallV110" href="/record?id={}">'
+                '<value>{}</value></a>'
+                '<div class="search-results-data-cite">Times Cited: {:,}</div>'
+                '</div>'.format(paper['uid'], escape(paper['title']),
+                                len(paper['citing'])))
+        body.append('</span>')
+        if page * PAGE < len(profile.papers):
+            body.append('<a title="Next Page" href="/results?sort={}&page={}">'
+                        'Next</a>'.format(sort, page + 1))
+        self.html('\n'.join(body))
+
+    def page_report(self, profile, query):
+        """ Citation report of all papers. """
+        number, citations, noself, h = profile.totals()
+        self.html(
+            '<span id="RESULTS_FOUND">{:,}</span>'
+            '<span id="GRAND_TOTAL_TC">{:,}</span>'
+            '<span id="TOTAL_TC_NO_SC">{:,}</span>'
+            '<span id="H_INDEX">{}</span>'
+            '<a id="GRAND_TOTAL_TC2" href="/citing?list=all">{:,}</a>'
+            '<a id="GRAND_TOTAL_TC3" href="/citing?list=report">{:,}</a>'
+            .format(number, citations, noself, h, len(profile.noself(True)),
+                    len(profile.noself())))
+
+    def page_citing(self, profile, query):
+        """ List of citing papers of the report, or of a single paper. """
+        records = self.records(profile, query['list'])
+        self.html('<span id="hitCount.top">{:,}</span>{}'.format(
+            len(records), _EXPORT.format(escape(query['list'], True))))
+
+    def page_record(self, profile, query):
+        """ Full record of a paper. """
+        paper = profile.find(query['id'])
+        cited = len(paper.get('citing', ()))
+        if cited:
+            count = ('<a href="/citing?list={}"><span class="TCcountFR">{:,}'
+                     '</span></a>'.format(paper['uid'], cited))
+        else:
+            count = '<span class="TCcountFR">0</span>'
+        impact = profile.journals[paper['issn']]
+        self.html('<div class="block-record-info"><h2>{}</h2>{}</div>'
+                  '<div class="block-text-content">{} Times Cited</div>{}'
+                  .format(escape(paper['title']),
+                          _EXPORT.format('record:' + paper['uid']), count,
+                          _JOURNAL.format(
+                              ''.join(['<th>{}</th>'.format(t)
+                                       for t, i in impact]),
+                              ''.join(['<td>{}</td>'.format(i)
+                                       for t, i in impact]))))
+
+    def page_export(self, profile, query):
+        """ Download records of a list as savedrecs file. """
+        records = self.records(profile, query['list'])
+        if not query['list'].startswith('record:'):
+            first = int(query.get('markFrom', '1').replace(',', '') or 1)
+            last = int(query.get('markTo', '').replace(',', '') or
+                       len(records))
+            records = records[first - 1:last]
+        references = query.get('fields_selection') == 'full'
+        if query.get('saveOptions') == 'fieldtagged':
+            data = 'FN Clarivate Analytics Web of Science\nVR 1.0\n{}\nEF\n' \
+                .format('\n'.join([profile.tagged(r) for r in records]))
+            self.respond(data, 'text/plain', 'savedrecs.txt')
+        else:
+            data = '\n'.join([profile.bibtex(r, references) for r in records])
+            self.respond(data, 'text/plain', 'savedrecs.bib')
+
+    def records(self, profile, name):
+        """ Records of a named list. """
+        if name == 'report':
+            return profile.noself()
+        if name == 'all':
+            return profile.noself(True)
+        if name.startswith('record:'):
+            return [profile.find(name[7:])]
+        return profile.cited(profile.find(name))
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    """ Threaded server of a profile, one thread per request. """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, profile, port=0, latency=0, verbose=False):
+        """ Serve profile on port (any free if 0), delaying each response. """
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.profile = profile
+        self.latency = latency
+        self.verbose = verbose
+        self.url = 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+
+def serve(papers=50, port=0, latency=0, seed=0, verbose=False):
+    """ Start serving a new profile in a background thread, return server. """
+    server = Server(Profile(papers, seed), port, latency, verbose)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--papers', type=int, default=50,
+                        help='number of papers in the profile')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds to wait before every response')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random profile')
+    parser.add_argument('--verbose', action='store_true',
+                        help='log every request')
+    args = parser.parse_args()
+    server = Server(Profile(args.papers, args.seed), args.port, args.latency,
+                    args.verbose)
+    print 'Serving {} papers at {}'.format(args.papers, server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
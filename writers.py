@@ -0,0 +1,283 @@
+"""
+Report writers producing JSON, HTML and Markdown instead of a PDF file.
+
+Writers render the same content as WebOfScience.latex: query and citation
+totals, formatted papers with impact factors and citation counts, citing
+papers and papers that could not be fetched. Entries are formatted by the
+Python implementation of the bst file, so no external program is run.
+"""
+
+from cgi import escape
+import json
+import re
+import unicodedata
+
+from bibtex import BibTex, _HTML
+
+
+# combining characters for LaTeX accents
+_ACCENTS = {
+    '"': u'\u0308', "'": u'\u0301', '`': u'\u0300', '^': u'\u0302',
+    '~': u'\u0303', '=': u'\u0304', '.': u'\u0307', 'u': u'\u0306',
+    'v': u'\u030c', 'H': u'\u030b', 'c': u'\u0327', 'k': u'\u0328',
+}
+_LETTERS = {'ss': u'\xdf', 'o': u'\xf8', 'O': u'\xd8', 'l': u'\u0142',
+            'L': u'\u0141', 'ae': u'\xe6', 'AE': u'\xc6', 'aa': u'\xe5',
+            'AA': u'\xc5', 'i': u'\u0131', 'j': u'\u0237'}
+_ACCENT = re.compile(r'\\([%s])\s*(?:\{\s*(\\?\w)\s*\}|(\\?\w))'
+                     % re.escape(''.join(_ACCENTS)))
+_LETTER = re.compile(r'\\(%s)\b\s*(?:\{\})?'
+                     % '|'.join(sorted(_LETTERS, key=len, reverse=True)))
+# commands put in items by BibTex postprocessing
+_LINKS = re.compile(r'\\(mref|zbl|arxiv|doi|url)\{([^{}]*)\}')
+_COMMAND = re.compile(r'\\([a-zA-Z]+)\s*|\\(?=[^a-zA-Z])')
+_TAG = re.compile(r'(</?font[^>]*>)')
+_MARKDOWN = {'emph': '***', 'textit': '*', 'textbf': '**', 'textsc': ''}
+# characters with a meaning in Markdown text
+_SPECIAL = re.compile(r'([\\`*_\[\]])')
+# places of emphasis and links while an item is escaped
+_PLACE = re.compile(u'\ue000(\\d+)\ue001')
+
+
+def _link(kind, value):
+    """ Text and URL of a number or link put in items. """
+    if kind == 'mref':
+        return value, 'http://www.ams.org/mathscinet-getitem?mr=' + value[2:]
+    if kind == 'zbl':
+        return 'Zbl ' + value, 'https://zbmath.org/?q=an:' + value
+    if kind == 'arxiv':
+        return 'arXiv:' + value, 'http://arxiv.org/abs/' + value
+    if kind == 'doi':
+        return 'doi:' + value, 'http://dx.doi.org/' + value
+    return value, value
+
+
+def _command(m):
+    """ Greek letter for a command of that name, otherwise nothing. """
+    name = m.group(1)
+    if not name:
+        return ''
+    try:
+        return unicodedata.lookup('GREEK {} LETTER {}'.format(
+            'CAPITAL' if name[0].isupper() else 'SMALL', name.upper()))
+    except KeyError:
+        return ''
+
+
+def markdown(text):
+    """ Text with HTML and Markdown special characters escaped. """
+    return _SPECIAL.sub(r'\\\1', escape(text))
+
+
+def detex(text, link=lambda text, url: text):
+    """ Unicode text from a formatted item, with links made by link. """
+    if isinstance(text, str):
+        text = text.decode('utf-8')
+    text = _LINKS.sub(lambda m: link(*_link(*m.groups())), text)
+    text = text.replace("$'$", "'").replace(r'\&', '&').replace(r'\%', '%')
+    text = _LETTER.sub(lambda m: _LETTERS[m.group(1)], text)
+
+    def accent(m):
+        letter = m.group(2) or m.group(3)
+        letter = _LETTERS.get(letter[1:], letter[1:]) \
+            if letter.startswith('\\') else letter
+        return unicodedata.normalize('NFC', letter + _ACCENTS[m.group(1)])
+    text = _ACCENT.sub(accent, text)
+    text = _COMMAND.sub(_command, text.replace(r'\$', u'\uffff'))
+    text = text.replace('$', '').replace(u'\uffff', '$')
+    text = text.replace('---', u'\u2014').replace('--', u'\u2013')
+    text = text.replace('~', u'\xa0').replace('{', '').replace('}', '')
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class Writer(object):
+
+    """ Collect report content from results, and write it to a file. """
+
+    ext = None
+    # formatting directives for papers and citing papers
+    styles = ({}, {'IncludeDOIURL': 'Exclude'})
+
+    def __init__(self, results, citing, full=True):
+        """
+        Prepare report of results.
+
+        citing(paper) returns entries citing the paper. With full, citing
+        papers are listed for each paper, not only counted.
+        """
+        self.results = results
+        self.citing = citing
+        self.full = full
+
+    def format(self, text):
+        """ Final form of a formatted item. """
+        return detex(text)
+
+    def content(self):
+        """ Report as a dictionary of plain data. """
+        results = self.results
+        bib = BibTex('python', **self.styles[0])
+        bib2 = BibTex('python', **self.styles[1])
+        papers = bib.runBatch([{k: v for k, v in p.items() if k != 'citing'}
+                               for p in results['papers']])
+        citing = {}
+        order = {}
+        if self.full:
+            citing = bib2.runBatch(results['citingindex'].values())
+            order = {k: n for n, k in enumerate(citing)}
+        content = {k: results.get(k) for k in (
+            'query', 'number', 'citations', 'citationsnoself', 'h-index')}
+        content['papers'] = []
+        for paper in results['papers']:
+            ids = []
+            if int(paper['cited']) and self.full:
+                ids = sorted([e['ID'] for e in self.citing(paper)
+                              if e['ID'] in order], key=order.get)
+            content['papers'].append({
+                'ID': paper['ID'],
+                'entry': self.format(papers.get(paper['ID'], '')),
+                'impact': {k.replace('impact', ''): v
+                           for k, v in paper.items() if 'impact' in k},
+                'cited': int(paper['cited']),
+                'citednoself': int(paper['citednoself']),
+                'citing': [{'ID': i, 'entry': self.format(citing[i])}
+                           for i in ids],
+            })
+        content['errors'] = list(results['errors'])
+        return content
+
+    def render(self, content):
+        """ Text of the report. """
+        raise NotImplementedError
+
+    def write(self, name):
+        """ Write report to name with the extension of the writer. """
+        text = self.render(self.content())
+        with open(name + '.' + self.ext, 'w') as f:
+            f.write(text.encode('utf-8') if isinstance(text, unicode)
+                    else text)
+
+
+class JSONWriter(Writer):
+
+    """ Report as a JSON document. """
+
+    ext = 'json'
+
+    def render(self, content):
+        """ Text of the report. """
+        return json.dumps(content, indent=1, sort_keys=True)
+
+
+class HTMLWriter(Writer):
+
+    """ Report as an HTML page. """
+
+    ext = 'html'
+    styles = ({'html': True, 'authorStyle': 'textbf', 'titleStyle': 'textit'},
+              {'html': True, 'IncludeDOIURL': 'Exclude'})
+
+    def format(self, text):
+        """ Final form of an item, with HTML code from BibTex kept. """
+        text = ''.join([part if n % 2 else escape(part)
+                        for n, part in enumerate(_TAG.split(text))])
+        return detex(text, lambda text, url: u'<a href="{}">{}</a>'.format(
+            url, text))
+
+    def render(self, content):
+        """ Text of the report. """
+        html = [u'<!DOCTYPE html>', u'<html><head><meta charset="utf-8">',
+                u'<title>{}</title></head><body>'.format(
+                    escape(content['query'] or '')),
+                u'<h2>Query</h2>',
+                u'<pre>{}</pre>'.format(escape(content['query'] or '')),
+                u'<h2>Citation counts</h2>', u'<ul>']
+        html.extend([u'<li>{}: {}</li>'.format(t, escape(content[k] or ''))
+                     for t, k in _TOTALS])
+        html.extend([u'</ul>', u'<h2>Papers</h2>', u'<ol>'])
+        if not content['papers']:
+            html.append(u'<li>Fetching failed for all papers.</li>')
+        for paper in content['papers']:
+            html.append(u'<li>' + paper['entry'])
+            html.append(u'<p>Journal impact factors: {}</p>'.format(
+                u' '.join([u'{}: {}.'.format(k, v)
+                           for k, v in sorted(paper['impact'].items())])))
+            html.append(u'<p>Cited by {} papers. Excluding self-citations: '
+                        u'{}</p>'.format(paper['cited'], paper['citednoself']))
+            if paper['citing']:
+                html.append(u'<p>Citing papers:</p><ol>')
+                html.extend([u'<li>{}</li>'.format(c['entry'])
+                             for c in paper['citing']])
+                html.append(u'</ol>')
+            html.append(u'</li>')
+        html.append(u'</ol>')
+        if content['errors']:
+            html.extend([u"<h2>Couldn't fetch papers:</h2>", u'<ol>'])
+            html.extend([u'<li>{}</li>'.format(escape(e))
+                         for e in content['errors']])
+            html.append(u'</ol>')
+        html.append(u'</body></html>')
+        return u'\n'.join(html) + u'\n'
+
+
+class MarkdownWriter(Writer):
+
+    """ Report as a Markdown document. """
+
+    ext = 'md'
+    styles = HTMLWriter.styles
+
+    def format(self, text):
+        """ Final form of an item, with HTML code turned into Markdown. """
+        # emphasis and links are kept in places, so only text is escaped
+        places = []
+
+        def place(code):
+            places.append(code)
+            return u'\ue000{}\ue001'.format(len(places) - 1)
+        for k, code in _HTML.items():
+            text = re.sub(re.escape(code) + r'\s*(.*?)\s*</font>',
+                          lambda m: place(_MARKDOWN[k]) + m.group(1) +
+                          place(_MARKDOWN[k]), text)
+        text = markdown(detex(text, lambda text, url: place(
+            u'[{}]({})'.format(markdown(text), url.replace(')', '%29')))))
+        return _PLACE.sub(lambda m: places[int(m.group(1))], text)
+
+    def render(self, content):
+        """ Text of the report. """
+        md = [u'## Query', u'', u'    ' + (content['query'] or ''), u'',
+              u'## Citation counts', u'']
+        md.extend([u'- {}: {}'.format(t, content[k]) for t, k in _TOTALS])
+        md.extend([u'', u'## Papers', u''])
+        if not content['papers']:
+            md.append(u'1. Fetching failed for all papers.')
+        for n, paper in enumerate(content['papers']):
+            md.append(u'{}. {}'.format(n + 1, paper['entry']))
+            md.append(u'')
+            md.append(u'    Journal impact factors: ' + u' '.join(
+                [u'{}: {}.'.format(k, v)
+                 for k, v in sorted(paper['impact'].items())]))
+            md.append(u'')
+            md.append(u'    Cited by {} papers. Excluding self-citations: {}'
+                      .format(paper['cited'], paper['citednoself']))
+            md.append(u'')
+            if paper['citing']:
+                md.append(u'    Citing papers:')
+                md.append(u'')
+                md.extend([u'    - ' + c['entry'] for c in paper['citing']])
+                md.append(u'')
+        if content['errors']:
+            md.extend([u'', u"## Couldn't fetch papers:", u''])
+            md.extend([u'{}. {}'.format(n + 1, markdown(e))
+                       for n, e in enumerate(content['errors'])])
+        return u'\n'.join(md) + u'\n'
+
+
+_TOTALS = [('Number of papers', 'number'),
+           ('Total number of citations', 'citations'),
+           ('Total number of citations without self-citations',
+            'citationsnoself'),
+           ('h-index', 'h-index')]
+
+# writers by format name
+WRITERS = {'json': JSONWriter, 'html': HTMLWriter, 'md': MarkdownWriter}